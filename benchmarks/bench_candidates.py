@@ -0,0 +1,139 @@
+"""
+Microbenchmark of the per-candidate overhead of handling Libgen search results.
+
+Takes a batch of synthetic search results through the steps BookScraper applies to them: build
+the result set, group the copies by title, rank every title's copies by expected cost and walk
+the mirror links of the copies. It times this with pandas DataFrames, the way the scraper used
+to do it, and with the Candidate and MirrorLinks records it uses now. It reports the time and
+the peak memory allocated per candidate, and the time it takes to import pandas.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_candidates --results 25 --rounds 200
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import pandas as pd
+
+from mirror_health import MirrorHealthTracker
+from records import Candidate, MIRROR_COLUMNS
+from source_planner import SourcePlanner
+
+
+def make_results(count, titles=5):
+    """
+    Build libgen_api style search results: several titles, each in a few formats and sizes.
+    """
+    extensions = ('epub', 'mobi', 'azw3', 'pdf')
+    return [{
+        'ID': str(index),
+        'Author': 'Benchmark Author',
+        'Title': f"Benchmark Book {index % titles}",
+        'Publisher': 'Benchmark Press',
+        'Year': '2020',
+        'Pages': '300',
+        'Language': 'English',
+        'Size': f"{1 + index % 7} Mb",
+        'Extension': extensions[index % len(extensions)],
+        'Mirror_1': f"http://library.lol/main/{index:032x}",
+        'Mirror_2': f"http://libgen.lc/ads.php?md5={index:032x}",
+        'Mirror_3': f"https://annas-archive.org/md5/{index:032x}",
+    } for index in range(count)]
+
+
+def dataframe_pipeline(results, planner):
+    books = pd.DataFrame(results)
+    books = books[["Title", "Extension", "Size", "Mirror_1", "Mirror_2", "Mirror_3"]]
+    urls = []
+    for title in books["Title"].drop_duplicates():
+        copies = books[books["Title"] == title]
+        costs = copies.apply(lambda row: _row_cost(planner, row), axis=1)
+        ranked = copies.assign(Cost=costs).dropna(subset=['Cost']).sort_values('Cost', kind='stable').drop(columns='Cost')
+        for _, row in ranked[list(MIRROR_COLUMNS)].iterrows():
+            urls.extend(row[mirror] for mirror in MIRROR_COLUMNS)
+    return urls
+
+
+def _row_cost(planner, row):
+    hosts = [planner._mirror_health.host_of(row[mirror]) for mirror in MIRROR_COLUMNS
+             if isinstance(row[mirror], str) and row[mirror]]
+    return planner.cost(str(row.get('Extension', '')).lower(), planner.parse_size(row.get('Size')), hosts)
+
+
+def record_pipeline(results, planner):
+    copies_by_title = {}
+    for result in results:
+        candidate = Candidate.from_result(result)
+        copies_by_title.setdefault(candidate.title, []).append(candidate)
+    urls = []
+    for copies in copies_by_title.values():
+        for candidate in planner.rank_libgen(copies):
+            urls.extend(candidate.links.by_column().values())
+    return urls
+
+
+PIPELINES = {
+    'pandas DataFrames': dataframe_pipeline,
+    'slotted records': record_pipeline,
+}
+
+
+def run(results_per_search, rounds):
+    """
+    Time every pipeline on the same search results.
+    :param results_per_search: The number of search results per round.
+    :param rounds: The number of rounds each pipeline runs.
+    :return: A dictionary mapping pipeline names to microseconds and bytes per candidate.
+    """
+    results = make_results(results_per_search)
+    planner = SourcePlanner(MirrorHealthTracker(path=os.path.join(tempfile.mkdtemp(), 'mirror_health.json')))
+    expected = dataframe_pipeline(results, planner)
+    report = {}
+    for name, pipeline in PIPELINES.items():
+        if pipeline(results, planner) != expected:
+            raise AssertionError(f"{name} walked the mirrors in a different order")
+        start_time = time.perf_counter()
+        for _ in range(rounds):
+            pipeline(results, planner)
+        micros = (time.perf_counter() - start_time) / (rounds * len(results)) * 1e6
+
+        tracemalloc.start()
+        pipeline(results, planner)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report[name] = {'us_per_candidate': micros, 'peak_bytes_per_candidate': peak / len(results)}
+    return report
+
+
+def pandas_import_seconds():
+    """
+    Return how long a fresh interpreter takes to import pandas.
+    """
+    command = "import time; start = time.perf_counter(); import pandas; print(time.perf_counter() - start)"
+    return float(subprocess.run([sys.executable, '-c', command], capture_output=True, text=True, check=True).stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmark of the per-candidate overhead of search results.')
+    parser.add_argument('--results', type=int, default=25, help='Number of search results per round.')
+    parser.add_argument('--rounds', type=int, default=200, help='Number of rounds each pipeline runs.')
+    args = parser.parse_args()
+
+    print(f"{'pipeline':<20}{'us/candidate':>14}{'peak B/candidate':>18}")
+    for name, entry in run(args.results, args.rounds).items():
+        print(f"{name:<20}{entry['us_per_candidate']:>14.1f}{entry['peak_bytes_per_candidate']:>18.0f}")
+    print(f"Importing pandas: {pandas_import_seconds() * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
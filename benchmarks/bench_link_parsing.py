@@ -0,0 +1,96 @@
+"""
+Microbenchmark of mirror page parsing.
+
+Times how long it takes to find the GET link of a mirror page with a full BeautifulSoup parse,
+as the scraper used to, with BeautifulSoup restricted to anchor tags, and with the targeted scan
+LinkResolver uses. The page is a synthetic download page of a realistic size.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_link_parsing --pages 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from link_resolver import parse_download_links
+
+
+def make_page(md5='0123456789abcdef0123456789abcdef', filler_links=60):
+    """
+    Build a download page similar to a Libgen mirror page: a header with navigation, a table of
+    book details, the GET link, alternative download links and a footer.
+    """
+    navigation = ''.join(f'<li><a href="/section/{n}">Section {n}</a></li>' for n in range(filler_links))
+    details = ''.join(f'<tr><td class="field">Field {n}</td><td>{"Lorem ipsum dolor sit amet " * 4}</td></tr>'
+                      for n in range(40))
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Download</title>'
+        '<script>var config = {"cdn": "https://cdn.example", "retries": 3};</script>'
+        '<style>body { font-family: sans-serif; } td.field { font-weight: bold; }</style></head>'
+        f'<body><ul id="nav">{navigation}</ul>'
+        f'<table id="info"><tr><td colspan="2"><h1>Benchmark Book</h1></td></tr>{details}</table>'
+        f'<div id="download"><h2><a href="get.php?md5={md5}&amp;key=ABCDEFGH1234">GET</a></h2>'
+        f'<ul><li><a href="https://cloudflare-ipfs.com/ipfs/{md5}">Cloudflare</a></li>'
+        f'<li><a href="https://ipfs.io/ipfs/{md5}">IPFS.io</a></li></ul></div>'
+        '<footer><p>Benchmark footer</p></footer></body></html>'
+    )
+
+
+def full_parse(page):
+    soup = BeautifulSoup(page, "html.parser")
+    links = soup.find_all("a", string=["GET"])
+    return {link.string: link["href"] for link in links if link.string == "GET"}
+
+
+def anchor_parse(page):
+    soup = BeautifulSoup(page, "html.parser", parse_only=SoupStrainer("a"))
+    link = soup.find("a", string="GET", href=True)
+    return {'GET': link["href"]} if link is not None else {}
+
+
+PARSERS = {
+    'full BeautifulSoup': full_parse,
+    'anchors only': anchor_parse,
+    'targeted scan': parse_download_links,
+}
+
+
+def run(pages):
+    """
+    Time every parser on the same page.
+    :param pages: The number of pages each parser parses.
+    :return: A dictionary mapping parser names to microseconds per page.
+    """
+    page = make_page()
+    expected = full_parse(page)
+    results = {}
+    for name, parse in PARSERS.items():
+        if parse(page) != expected:
+            raise AssertionError(f"{name} found {parse(page)}, expected {expected}")
+        start_time = time.perf_counter()
+        for _ in range(pages):
+            parse(page)
+        results[name] = (time.perf_counter() - start_time) / pages * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmark of mirror page parsing.')
+    parser.add_argument('--pages', type=int, default=500, help='Number of pages each parser parses.')
+    args = parser.parse_args()
+
+    print(f"Page size: {len(make_page())} bytes")
+    for name, micros in run(args.pages).items():
+        print(f"{name:<20}{micros:>12.1f} us/page")
+
+
+if __name__ == '__main__':
+    main()
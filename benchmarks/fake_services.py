@@ -0,0 +1,286 @@
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+import zipfile
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def build_epub(size):
+    """
+    Build a structurally valid EPUB padded to roughly the given size.
+    :param size: The target size in bytes.
+    :return: The EPUB contents.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as epub:
+        epub.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        epub.writestr('META-INF/container.xml', (
+            '<?xml version="1.0"?><container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+            '<rootfiles><rootfile full-path="content.opf" media-type="application/oebps-package+xml"/></rootfiles>'
+            '</container>'))
+        epub.writestr('content.opf', '<?xml version="1.0"?><package xmlns="http://www.idpf.org/2007/opf" version="3.0"/>')
+        padding = random.Random(0).randbytes(max(0, size - buffer.tell()))
+        epub.writestr(zipfile.ZipInfo('OEBPS/padding.bin'), padding, compress_type=zipfile.ZIP_STORED)
+    return buffer.getvalue()
+
+
+class FakeServices:
+    """
+    Local stand-ins for Libgen, its mirror pages, the Z-Library eapi, an OpenAI-compatible chat
+    endpoint and the SendGrid mail endpoint, served from one threaded HTTP server.
+
+    Every request is delayed by the configured latency of its service and fails with the
+    configured probability, so that runs are reproducible without touching the real services.
+
+    Routes:
+        GET  /search.php               Libgen search results page
+        GET  /ads.php?md5=...          Libgen mirror page with a GET link
+        GET  /get.php?md5=...          The book file, with Range support
+        POST /eapi/user/login          Z-Library login
+        POST /eapi/book/search         Z-Library search
+        GET  /eapi/book/<id>/<hash>/file  Z-Library download metadata
+        GET  /eapi/book/<id>/<hash>/formats  Z-Library formats of a book
+        GET  /eapi/book/<id>/<hash>/send-to-kindle  Z-Library send-to-Kindle
+        GET  /zdl/<hash>               The Z-Library book file
+        POST /v1/chat/completions      OpenAI-compatible chat completion
+        POST /v3/mail/send             SendGrid mail send
+    """
+
+    SERVICES = ('libgen', 'mirror', 'zlibrary', 'openai', 'sendgrid')
+    LIBGEN_COLUMNS = 15
+
+    def __init__(self, latency=None, failure_rate=None, jitter=0.2, book_size=512 * 1024, libgen_miss_rate=0.0, seed=0):
+        """
+        Initializes the FakeServices object.
+        :param latency: Seconds of latency per service, as a mapping or a single value for all.
+        :param failure_rate: Probability of a 503 per service, as a mapping or a single value for all.
+        :param jitter: The relative random variation applied to every latency.
+        :param book_size: The size in bytes of the served book file.
+        :param libgen_miss_rate: Probability that a Libgen search returns nothing, pushing the
+            book to the Z-Library fallback.
+        :param seed: The seed of the random number generator.
+        """
+        self.latency = self._per_service(latency, 0.0)
+        self.failure_rate = self._per_service(failure_rate, 0.0)
+        self.jitter = jitter
+        self.libgen_miss_rate = libgen_miss_rate
+        self.book = build_epub(book_size)
+        self.book_md5 = hashlib.md5(self.book).hexdigest()
+        self.requests = {service: 0 for service in self.SERVICES}
+        self.bytes_received = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _per_service(self, value, default):
+        if isinstance(value, dict):
+            return {service: value.get(service, default) for service in self.SERVICES}
+        return {service: default if value is None else value for service in self.SERVICES}
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def mirror_urls(self):
+        """
+        Return three mirror page URLs for the served book, on two different host names.
+        """
+        port = self._server.server_address[1]
+        return [
+            f"http://127.0.0.1:{port}/ads.php?md5={self.book_md5}",
+            f"http://localhost:{port}/ads.php?md5={self.book_md5}",
+            f"http://127.0.0.1:{port}/ads.php?md5={self.book_md5}&mirror=3",
+        ]
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _delay_and_roll(self, service):
+        """
+        Sleep for the service's latency and decide whether this request fails.
+        """
+        with self._lock:
+            self.requests[service] += 1
+            delay = self.latency[service] * (1 + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.failure_rate[service]
+        if delay > 0:
+            time.sleep(delay)
+        return failed
+
+    def _libgen_page(self, query):
+        with self._lock:
+            miss = self._random.random() < self.libgen_miss_rate
+        rows = [] if miss else [
+            (f"{query}: Summary and Analysis", 'epub'),
+            (query, 'epub'),
+            (query, 'mobi'),
+        ]
+        cells = []
+        for index, (title, extension) in enumerate(rows):
+            mirror_urls = self.mirror_urls()
+            mirrors = ''.join(f'<td><a href="{escape(mirror_urls[n % len(mirror_urls)])}" title="mirror">[{n + 1}]</a></td>'
+                              for n in range(5))
+            cells.append(
+                f'<tr><td>{index}</td><td>Benchmark Author</td>'
+                f'<td><a href="book/index.php?md5={self.book_md5}" id="{index}">{escape(title)}</a></td>'
+                f'<td>Publisher</td><td>2020</td><td>300</td><td>English</td>'
+                f'<td>{len(self.book) // 1024} Kb</td><td>{extension}</td>{mirrors}'
+                f'<td><a href="#" title="edit">[edit]</a></td></tr>'
+            )
+        header = ''.join(f'<th>{n}</th>' for n in range(self.LIBGEN_COLUMNS))
+        return (f'<html><body><table></table><table></table>'
+                f'<table><tr>{header}</tr>{"".join(cells)}</table></body></html>')
+
+    def _make_handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def _send(self, status, body=b'', content_type='application/json', headers=None):
+                if isinstance(body, str):
+                    body = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _send_json(self, payload, status=200):
+                self._send(status, json.dumps(payload))
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                with services._lock:
+                    services.bytes_received += len(body)
+                return body
+
+            def _fail(self):
+                self._send(503, json.dumps({'error': 'injected failure'}), headers={'Retry-After': '0'})
+
+            def _send_book(self, filename):
+                book = services.book
+                headers = {
+                    'Content-Disposition': f'attachment; filename="{filename}"',
+                    'Accept-Ranges': 'bytes',
+                }
+                match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if match:
+                    start = int(match.group(1))
+                    end = int(match.group(2)) if match.group(2) else len(book) - 1
+                    headers['Content-Range'] = f'bytes {start}-{end}/{len(book)}'
+                    self._send(206, book[start:end + 1], 'application/epub+zip', headers)
+                else:
+                    self._send(200, book, 'application/epub+zip', headers)
+
+            def _route(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                path = url.path
+
+                if path == '/search.php':
+                    service = 'libgen'
+                elif path in ('/ads.php', '/get.php'):
+                    service = 'mirror'
+                elif path.startswith(('/eapi', '/zdl')):
+                    service = 'zlibrary'
+                elif path.startswith('/v1'):
+                    service = 'openai'
+                elif path.startswith('/v3'):
+                    service = 'sendgrid'
+                else:
+                    self._send(404, '{}')
+                    return
+
+                body = self._read_body() if self.command == 'POST' else b''
+                if services._delay_and_roll(service):
+                    self._fail()
+                    return
+
+                if path == '/search.php':
+                    self._send(200, services._libgen_page(query.get('req', [''])[0]), 'text/html')
+                elif path == '/ads.php':
+                    md5 = query.get('md5', [''])[0]
+                    self._send(200, (f'<html><body><h2>Download</h2><a href="/get.php?md5={md5}&key=BENCH">GET</a>'
+                                     f'<a href="https://ipfs.example/{md5}">Cloudflare</a></body></html>'), 'text/html')
+                elif path == '/get.php':
+                    self._send_book(f"{query.get('md5', ['book'])[0]}.epub")
+                elif path == '/eapi/user/login':
+                    self._send_json({'success': 1, 'user': {
+                        'email': 'bench@example.com', 'name': 'bench', 'kindle_email': 'bench@kindle.com',
+                        'id': 1, 'remix_userkey': 'bench',
+                    }})
+                elif path == '/eapi/book/search':
+                    message = parse_qs(body.decode()).get('message', [''])[0]
+                    self._send_json({'success': 1, 'books': [
+                        {'id': 1, 'hash': 'summary', 'title': f'{message}: Summary', 'extension': 'epub',
+                         'filesize': len(services.book), 'cover': '/covers/books/00/summary.jpg'},
+                        {'id': 2, 'hash': services.book_md5, 'title': message, 'extension': 'epub',
+                         'filesize': len(services.book), 'cover': f'/covers/books/00/{services.book_md5}.jpg'},
+                    ], 'pagination': {'current': 1, 'total_pages': 1}})
+                elif re.match(r'/eapi/book/\w+/\w+/file$', path):
+                    book_hash = path.split('/')[-2]
+                    self._send_json({'success': 1, 'file': {
+                        'description': 'Benchmark Book', 'author': 'Benchmark Author', 'extension': 'epub',
+                        'downloadLink': f'{services.base_url}/zdl/{book_hash}',
+                    }})
+                elif re.match(r'/eapi/book/\w+/\w+/formats$', path):
+                    book_id, book_hash = path.split('/')[-3:-1]
+                    self._send_json({'success': 1, 'books': [
+                        {'id': book_id, 'hash': book_hash, 'extension': 'epub', 'filesize': len(services.book)},
+                    ]})
+                elif re.match(r'/eapi/book/\w+/\w+/send-to-kindle$', path):
+                    self._send_json({'success': 1})
+                elif path.startswith('/zdl/'):
+                    self._send_book('zlibrary.epub')
+                elif path == '/v1/chat/completions':
+                    prompt = json.loads(body or b'{}').get('messages', [{}])[-1].get('content', '')
+                    answer = 'no' if 'summary' in prompt.lower() else 'yes'
+                    self._send_json({
+                        'id': 'chatcmpl-bench', 'object': 'chat.completion', 'created': int(time.time()),
+                        'model': 'gpt-3.5-turbo',
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': answer}}],
+                        'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+                    })
+                elif path == '/v3/mail/send':
+                    self._send(202, b'', 'text/plain', {'X-Message-Id': 'bench'})
+                else:
+                    self._send(404, '{}')
+
+            do_GET = _route
+            do_HEAD = _route
+            do_POST = _route
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
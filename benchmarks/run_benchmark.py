@@ -0,0 +1,210 @@
+"""
+Offline end-to-end benchmark of the collector pipeline.
+
+Starts the local service stand-ins from fake_services, points BookScraper, Zlibrary, the OpenAI
+client and MailService at them, and drives the title search flow and the BookManager CSV batch
+flow, followed by email delivery. Reports books per minute, p50/p95 latency per stage and peak
+RSS. Downloads use the hedged HTTP mode since the stand-ins cannot be driven through Chrome.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmark --books 20 --latency 0.05 --failure-rate 0.05
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import pandas as pd
+from icecream import ic
+from openai import OpenAI
+
+import book_scraper
+from benchmarks.fake_services import FakeServices
+from book_manager import BookManager
+from book_scraper import BookScraper
+from mail_service import MailService
+from metrics import metrics
+from mirror_health import MirrorHealthTracker
+from rate_limiter import api_key_bucket, rate_limiter
+from zlibrary import Zlibrary
+
+
+def _point_libgen_at(services):
+    """
+    The scraper fetches libgen_api's search page from libgen.is, so it is pointed at the stand-in.
+    """
+    book_scraper.LIBGEN_SEARCH_URL = f"{services.base_url}/search.php"
+
+
+def _disable_isbn_lookups():
+    """
+    The isbn services have no stand-in, so metadata lookups return nothing.
+    """
+    book_scraper.isbn_from_words = lambda words: ''
+    book_scraper.meta = lambda isbn: {}
+
+
+def _lift_rate_limits(services, mail_service):
+    port = services.base_url.rsplit(':', 1)[1]
+    keys = ('libgen.is', 'isbn', 'api.openai.com', 'api.sendgrid.com', f'127.0.0.1:{port}', f'localhost:{port}',
+            api_key_bucket('openai', 'benchmark'), api_key_bucket('sendgrid', mail_service.SENDGRID_API_KEY))
+    for key in keys:
+        rate_limiter.set_limit(key, 10_000, 10_000)
+
+
+def _stage_report():
+    report = {}
+    for histogram in metrics.snapshot()['histograms']:
+        if histogram['name'] != 'stage_seconds':
+            continue
+        stage = histogram['labels']['stage']
+        entry = report.setdefault(stage, {'count': 0, 'p50': 0.0, 'p95': 0.0})
+        entry['count'] += histogram['count']
+        entry['p50'] = max(entry['p50'], histogram['p50'])
+        entry['p95'] = max(entry['p95'], histogram['p95'])
+    return report
+
+
+def _count_books(directory):
+    return sum(1 for entry in os.scandir(directory) if entry.is_file())
+
+
+def run(books, flow, latency, failure_rate, book_size, libgen_miss_rate, real_limits=False, delivery_mode='download',
+        recipients=1):
+    """
+    Run the benchmark in a scratch directory.
+    :param books: The number of books per flow.
+    :param flow: 'title', 'csv' or 'all'.
+    :param latency: The latency in seconds of every stand-in.
+    :param failure_rate: The probability of an injected 503 on every stand-in.
+    :param book_size: The size in bytes of the served books.
+    :param libgen_miss_rate: The probability that a Libgen search comes back empty.
+    :param real_limits: Keep the production rate limits instead of lifting them.
+    :param delivery_mode: 'download' or 'kindle', see BookScraper.
+    :param recipients: The number of addresses every book is emailed to.
+    :return: A dictionary with the results.
+    """
+    ic.disable()
+    metrics.reset()
+    workdir = tempfile.mkdtemp(prefix='book-collector-bench-')
+    os.chdir(workdir)
+    for directory in ('Books', 'Downloads', 'Logs'):
+        os.makedirs(directory, exist_ok=True)
+
+    with FakeServices(latency=latency, failure_rate=failure_rate, book_size=book_size,
+                      libgen_miss_rate=libgen_miss_rate) as services:
+        _point_libgen_at(services)
+        _disable_isbn_lookups()
+        mail_service = MailService(host=services.base_url)
+        if not real_limits:
+            _lift_rate_limits(services, mail_service)
+
+        client = OpenAI(api_key='benchmark', base_url=f"{services.base_url}/v1", max_retries=0)
+        zlibrary = Zlibrary(email='bench@example.com', password='benchmark', base_url=services.base_url)
+        manager = BookManager(from_email='bench@example.com', delivery_mode=delivery_mode,
+                              to_email=[f'kindle{index}@example.com' for index in range(recipients)])
+        scraper = BookScraper(client=client, zlibrary=zlibrary, hedged=True, delivery_mode=delivery_mode,
+                              delivery_log=manager.delivery_log,
+                              mirror_health=MirrorHealthTracker(path=os.path.join(workdir, 'Logs', 'mirror_health.json')))
+        manager.scraper = scraper
+        manager.mail_service = mail_service
+
+        results = {'flows': {}}
+        start_time = time.perf_counter()
+
+        if flow in ('title', 'all'):
+            flow_start = time.perf_counter()
+            before = _count_books('Books')
+            for index in range(books):
+                try:
+                    scraper.scrape_book(f"Benchmark Book {index}")
+                except Exception as e:
+                    results.setdefault('errors', []).append(f"title {index}: {e}")
+            elapsed = time.perf_counter() - flow_start
+            done = _count_books('Books') - before
+            results['flows']['title'] = {'books': done, 'seconds': elapsed, 'books_per_minute': 60 * done / elapsed}
+
+        if flow in ('csv', 'all'):
+            csv_path = os.path.join(workdir, 'books.csv')
+            mirrors = services.mirror_urls()
+            pd.DataFrame([{'Title': f"Benchmark CSV Book {index}", 'Mirror_1': mirrors[0],
+                           'Mirror_2': mirrors[1], 'Mirror_3': mirrors[2]} for index in range(books)]).to_csv(csv_path, index=False)
+            flow_start = time.perf_counter()
+            before = _count_books('Books')
+            try:
+                manager.scrape_books('1', manager._get_book_data_from_csv(csv_path))
+            except Exception as e:
+                results.setdefault('errors', []).append(f"csv: {e}")
+            elapsed = time.perf_counter() - flow_start
+            done = _count_books('Books') - before
+            results['flows']['csv'] = {'books': done, 'seconds': elapsed, 'books_per_minute': 60 * done / elapsed}
+
+        flow_start = time.perf_counter()
+        manager._send_books_to_email()
+        results['delivery_seconds'] = time.perf_counter() - flow_start
+
+        total = time.perf_counter() - start_time
+        delivered = _count_books('Books')
+        results.update({
+            'workdir': workdir,
+            'books': delivered,
+            'seconds': total,
+            'books_per_minute': 60 * delivered / total if total else 0.0,
+            'stages': _stage_report(),
+            'requests': dict(services.requests),
+            'deliveries': manager.delivery_log.summary(),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        })
+    return results
+
+
+def _print_report(results):
+    print(f"Books: {results['books']} in {results['seconds']:.2f}s ({results['books_per_minute']:.1f} books/minute)")
+    for name, flow in results['flows'].items():
+        print(f"  {name:<6} {flow['books']:>4} books {flow['seconds']:8.2f}s {flow['books_per_minute']:8.1f} books/minute")
+    print(f"Delivery: {results['delivery_seconds']:.2f}s {results['deliveries']}")
+    print(f"{'stage':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    for stage, entry in sorted(results['stages'].items()):
+        print(f"{stage:<20}{entry['count']:>8}{entry['p50'] * 1000:>10.1f}{entry['p95'] * 1000:>10.1f}")
+    print(f"Peak RSS: {results['peak_rss_mb']:.1f} MB")
+    for error in results.get('errors', []):
+        print(f"Error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark against local service stand-ins.')
+    parser.add_argument('--books', type=int, default=10, help='Number of books per flow.')
+    parser.add_argument('--flow', choices=('title', 'csv', 'all'), default='all')
+    parser.add_argument('--latency', type=float, default=0.02, help='Latency in seconds of every stand-in.')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Probability of an injected 503.')
+    parser.add_argument('--book-size', type=int, default=512 * 1024, help='Size in bytes of each book.')
+    parser.add_argument('--libgen-miss-rate', type=float, default=0.0,
+                        help='Probability that a Libgen search is empty and Z-Library is used instead.')
+    parser.add_argument('--delivery-mode', choices=('download', 'kindle'), default='download',
+                        help='How Z-Library matches are delivered.')
+    parser.add_argument('--recipients', type=int, default=1, help='Number of addresses every book is emailed to.')
+    parser.add_argument('--real-limits', action='store_true', help='Keep the production rate limits.')
+    parser.add_argument('--json', metavar='PATH', help='Also write the results as JSON.')
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    results = run(args.books, args.flow, args.latency, args.failure_rate, args.book_size,
+                  args.libgen_miss_rate, real_limits=args.real_limits, delivery_mode=args.delivery_mode,
+                  recipients=args.recipients)
+    os.chdir(cwd)
+    _print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,37 @@
 from book_manager import BookManager
 from dotenv import load_dotenv
+import argparse
 import os
 
 def main():
 
     load_dotenv()
 
+    parser = argparse.ArgumentParser(description='Collect books and send them to Kindle.')
+    parser.add_argument('--daemon', action='store_true', help='Run as a long-lived collector with a local HTTP job API.')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface the daemon binds to.')
+    parser.add_argument('--port', type=int, default=8765, help='Port the daemon binds to.')
+    parser.add_argument('--workers', type=int, default=2, help='Number of jobs the daemon processes concurrently.')
+    parser.add_argument('--send-to-kindle', action='store_true',
+                        help='Have Z-Library send its matches straight to the Kindle address on your Z-Library account.')
+    parser.add_argument('--optimize-epub', action='store_true',
+                        help='Recompress downloaded EPUBs and downsample their images before delivery (resizing needs Pillow).')
+    parser.add_argument('--hedged', action='store_true', help='Let the daemon download over HTTP, hedging across mirrors.')
+    args = parser.parse_args()
+
+    if args.daemon:
+        from collector_daemon import CollectorDaemon
+
+        CollectorDaemon(host=args.host, port=args.port, workers=args.workers, hedged=args.hedged,
+                        delivery_mode='kindle' if args.send_to_kindle else 'download',
+                        optimize=args.optimize_epub).serve_forever()
+        return
+
     book_manager = BookManager(
         from_email=os.getenv('GMAIL'),
-        to_email=os.getenv('KINDLE_EMAIL'),
+        to_email=[address.strip() for address in os.getenv('KINDLE_EMAIL', '').split(',') if address.strip()],
+        delivery_mode='kindle' if args.send_to_kindle else 'download',
+        optimize=args.optimize_epub,
     )
 
     book_manager.main()
@@ -17,4 +40,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,5 +1,15 @@
 from mail_service import MailService
 from book_scraper import BookScraper
+from metrics import metrics
+from delivery_log import DeliveryLog
+from outbox import Outbox, OutboxSender
+from sent_ledger import SentLedger
+from records import MirrorLinks
+from file_validator import validate_book
+from epub_optimizer import EpubOptimizer
+from request_normalizer import group_requests
+from not_found_store import NotFoundStore
+from deadline import DeadlineExceeded
 import pandas as pd
 import os
 from icecream import ic
@@ -13,39 +23,73 @@ class BookManager:
     Attributes:
         BOOK_DIRECTORY (str): The directory where the books are stored.
         from_email (str): The email address from which the books will be sent.
-        to_email (str): The email address to which the books will be sent.
+        recipients (list): The email addresses to which the books will be sent.
+        delivery_mode (str): 'download' to download Z-Library matches, or 'kindle' to have Z-Library send them to Kindle directly.
+        delivery_log (DeliveryLog): Records the outcome of every delivery.
+        optimizer (EpubOptimizer): Shrinks downloaded books before delivery, or None.
         mail_service (MailService): An instance of the MailService class for sending emails.
+        outbox (Outbox): The durable queue of books waiting to be emailed.
+        ledger (SentLedger): Records which books were delivered to which recipients.
+        not_found (NotFoundStore): Remembers the books that were not found recently.
+        sender (OutboxSender): Sends the queued books in the background while it is running, or None.
+        send_as_collected (bool): Whether every collected book is queued for email right away.
         scraper (BookScraper): An instance of the BookScraper class for scraping books.
         choice_to_function (dict): A dictionary mapping user choices to corresponding functions.
     """
 
     BOOK_DIRECTORY = 'Books/'
+    METRICS_FILE = 'Logs/metrics.prom'
+    METRICS_SNAPSHOT_FILE = 'Logs/metrics.json'
 
-    def __init__(self, from_email, to_email):
+    def __init__(self, from_email, to_email, delivery_mode='download', optimize=False):
         """
         Initializes a new instance of the BookManager class.
 
         Args:
             from_email (str): The email address from which the books will be sent.
-            to_email (str): The email address to which the books will be sent.
+            to_email (str or list): The email address, or list of addresses, to which the books
+                will be sent.
+            delivery_mode (str, optional): 'download' to download Z-Library matches into the books
+                folder, or 'kindle' to have Z-Library send them straight to Kindle.
+            optimize (bool, optional): Recompress downloaded EPUBs and downsample their images
+                before delivery.
         """
         self.from_email = from_email
-        self.to_email = to_email
+        self.recipients = [to_email] if isinstance(to_email, str) else list(to_email)
+        self.delivery_mode = delivery_mode
+        self.delivery_log = DeliveryLog()
+        self.optimizer = EpubOptimizer() if optimize else None
         self.mail_service = None
+        self.outbox = Outbox()
+        self.ledger = SentLedger()
+        self.not_found = NotFoundStore()
+        self.sender = None
+        self.send_as_collected = False
         self.scraper = None
         self.choice_to_function = {}
 
-    def _get_book_data_from_csv(self):
+    def _get_book_data_from_csv(self, file_location=None):
         """
         Retrieves book data from a CSV file.
 
+        Rows asking for the same book, by ISBN or by a trivially different title, are merged
+        before the batch starts, so that every book is only searched and downloaded once. The
+        mirror URLs of all merged rows are kept as fallbacks.
+
+        Args:
+            file_location (str, optional): The location of the CSV file. Prompted for if not given.
+
         Returns:
-            A generator that yields tuples containing the book title and mirror URLs.
+            A generator that yields tuples containing the book title and a list of MirrorLinks, one per merged CSV row.
         """
-        file_location = input('Enter the location of the CSV file: ')
+        if file_location is None:
+            file_location = input('Enter the location of the CSV file: ')
         books_csv = pd.read_csv(file_location)
-        for _, row in books_csv.iterrows():
-            yield row['Title'], row[['Mirror_1', 'Mirror_2', 'Mirror_3']]
+        groups = group_requests(books_csv.to_dict('records'), title_of=lambda row: row['Title'])
+        for rows in groups.values():
+            if len(rows) > 1:
+                ic(f"Merged {len(rows)} requests for '{rows[0]['Title']}'.")
+            yield rows[0]['Title'], [MirrorLinks.from_row(row) for row in rows]
 
     def _get_book_data_manually(self):
         """
@@ -67,13 +111,101 @@ class BookManager:
             download_link = input('Enter the download link of the book: ')
             yield book_name, download_link
 
+    def _queue_book_for_email(self, book_path):
+            """
+            Queues a book in the outbox to be emailed to every recipient that has not received
+            it yet.
+
+            Recipients that were sent the same file before, according to the ledger, or that it
+            is already queued for, are left out. Books that are too large to send, even after
+            optimization, and files that are not valid books are skipped and recorded as such.
+
+            Args:
+                book_path (str): The path of the book.
+
+            Returns:
+                str: The id of the outbox entry, or None if the book was skipped.
+            """
+            if self.mail_service is None:
+                self.mail_service = MailService()
+            filename = os.path.basename(book_path)
+            md5 = self.ledger.file_hash(book_path)
+            queued = self.outbox.queued_recipients(md5)
+            recipients = [recipient for recipient in self.ledger.unsent_recipients(md5, self.recipients)
+                          if recipient not in queued]
+            if not recipients:
+                return None
+            if not self.mail_service.attachment_fits(book_path):
+                size = os.path.getsize(book_path)
+                ic(f"Skipping '{filename}', {size} bytes is too large to send by email.")
+                for recipient in recipients:
+                    self.delivery_log.record(
+                        book=filename,
+                        recipient=recipient,
+                        channel='email',
+                        status=DeliveryLog.SKIPPED,
+                        detail=f'too large: {size} bytes',
+                    )
+                return None
+            reason = validate_book(book_path)
+            if reason is not None:
+                ic(f"Skipping '{filename}', {reason}.")
+                for recipient in recipients:
+                    self.delivery_log.record(
+                        book=filename,
+                        recipient=recipient,
+                        channel='email',
+                        status=DeliveryLog.SKIPPED,
+                        detail=f'invalid: {reason}',
+                    )
+                return None
+            return self.outbox.enqueue(
+                from_email=self.from_email,
+                recipients=recipients,
+                file_path=book_path,
+                file_name=filename,
+                md5=md5,
+                subject='Sending books to Kindle',
+                html_content='<h1>Here is your book!</h1>',
+            )
+
+    def _start_sender(self):
+            """
+            Starts sending the books in the outbox in the background, including any left over
+            from an earlier run.
+            """
+            if self.mail_service is None:
+                self.mail_service = MailService()
+            if self.sender is None:
+                self.sender = OutboxSender(self.outbox, self.mail_service, delivery_log=self.delivery_log,
+                                           ledger=self.ledger).start()
+
+    def _finish_sending(self):
+            """
+            Waits for the books that are due to be sent and stops the background sender.
+
+            Books whose send failed and is waiting to be retried stay in the outbox for the next
+            run, and books that could not be delivered at all are reported.
+            """
+            if self.sender is None:
+                return
+            self.sender.stop(drain=True)
+            self.sender = None
+            if self.outbox.pending():
+                ic(f"{self.outbox.pending()} books are waiting to be retried and will be sent on the next run.")
+            for entry in self.outbox.dead_letters():
+                ic(f"Could not deliver '{entry['file_name']}' to {entry['recipients']}: {entry['last_error']}")
+
     def _send_books_to_email(self):
             """
-            Sends books to the specified email address as attachments.
+            Sends books to the specified email addresses as attachments.
 
-            This method iterates over the files in the BOOK_DIRECTORY and sends each file as an attachment
-            to the specified email address using the MailService class. The email includes a subject, 
-            a body in HTML format, and the book file as an attachment.
+            This method queues every file in the BOOK_DIRECTORY in the outbox and waits for the
+            background sender to deliver them. The email includes a subject, a body in HTML
+            format, and the book file as an attachment. Each book is encoded and uploaded once
+            for all recipients, failed sends are retried, and the outcome is recorded per recipient.
+            Only files added or changed since they were last delivered to a recipient are sent to
+            it, so the folder never needs to be cleared to keep sends fast.
 
             Args:
                 self (BookManager): The BookManager instance.
@@ -81,18 +213,10 @@ class BookManager:
             Returns:
                 None
             """
-            
-            self.mail_service = MailService()
+            self._start_sender()
             for filename in os.listdir(self.BOOK_DIRECTORY):
-                book_path = os.path.join(self.BOOK_DIRECTORY, filename)
-                self.mail_service.send_email_with_attachment(
-                    from_email=self.from_email,
-                    to_email=self.to_email,
-                    file_path=book_path,
-                    file_name=filename,
-                    subject='Sending books to Kindle',
-                    html_content='<h1>Here is your book!</h1>',
-                )
+                self._queue_book_for_email(os.path.join(self.BOOK_DIRECTORY, filename))
+            self._finish_sending()
 
     def _clear_folder(self, folder_path):
             """
@@ -112,6 +236,38 @@ class BookManager:
                     item.unlink()
 
 
+    def scrape_books(self, choice, books):
+        """
+        Scrapes every book yielded by one of the book data getters.
+
+        Args:
+            choice (str): The menu choice the book data was produced for ('1', '2' or '3').
+            books (iterable): The items yielded by the matching book data getter.
+        """
+        if self.scraper is None:
+            self.scraper = BookScraper(delivery_mode=self.delivery_mode, delivery_log=self.delivery_log,
+                                       optimizer=self.optimizer, not_found=self.not_found)
+        for book_data in books:
+            book_path = None
+            try:
+                if choice == '1':
+                    book_name, download_links = book_data
+                    book_path = self.scraper.scrape_book(book_name, download_links=download_links)
+                elif choice == '2':
+                    book_name = book_data
+                    # A book that was not found recently is skipped unless the user asks for it
+                    force = self.not_found.is_known_miss(book_name) and input(
+                        f"'{book_name}' was not found recently. Search for it again anyway? (y/n): ").lower() == 'y'
+                    book_path = self.scraper.scrape_book(book_name, force=force)
+                elif choice == '3':
+                    book_name, download_link = book_data
+                    book_path = self.scraper.scrape_book(book_name, download_link=download_link)
+            except DeadlineExceeded as e:
+                # A book that ran out of time is given up so the rest of the batch still runs
+                ic(f"Gave up on '{book_name}': {e}")
+            if self.send_as_collected and book_path is not None and os.path.isfile(book_path):
+                self._queue_book_for_email(book_path)
+
     def main(self):
         """
         Main method for the book manager.
@@ -122,6 +278,11 @@ class BookManager:
             '2': self._get_book_data_manually,
             '3': self._get_book_data_with_link,
         }
+        send_books = input('Do you want to send the books to your email as they are collected? (y/n): ')
+        self.send_as_collected = send_books.lower() == 'y'
+        if self.send_as_collected or self.outbox.pending():
+            self._start_sender()
+
         while True:
             choice = input('Enter 1 to read from a CSV file, 2 to enter the book name manually, or 3 to provide the book name and download link: ')
             get_book_data = self.choice_to_function.get(choice)
@@ -130,17 +291,7 @@ class BookManager:
                 ic('Invalid choice. Please enter 1, 2, or 3.')
                 return
 
-            self.scraper = BookScraper()
-            for book_data in get_book_data():
-                if choice == '1':
-                    book_name, download_links = book_data
-                    self.scraper.scrape_book(book_name, download_links=download_links)
-                elif choice == '2':
-                    book_name = book_data
-                    self.scraper.scrape_book(book_name)
-                elif choice == '3':
-                    book_name, download_link = book_data
-                    self.scraper.scrape_book(book_name, download_link=download_link)
+            self.scrape_books(choice, get_book_data())
             user_input = input('Do you want to scrape another book? (y/n): ')
             if user_input.lower() != 'y':
                 break
@@ -150,10 +301,20 @@ class BookManager:
         
         has_epub_files = any(file.suffix == '.epub' for file in Path(self.BOOK_DIRECTORY).iterdir())
 
+        # The ledger leaves out the books that were already sent or queued as they were collected,
+        # and queued books are kept in the outbox, so the folder can be cleared while they are sent
         if has_epub_files:
             if send_books.lower() == 'y':
                 self._send_books_to_email()
             if clear_books.lower() == 'y':
                 self._clear_folder(self.BOOK_DIRECTORY)
         else:
-            ic('No books to send or clear.')
\ No newline at end of file
+            ic('No books to send or clear.')
+
+        self._finish_sending()
+
+        if self.delivery_log.entries:
+            ic(self.delivery_log.summary())
+
+        metrics.write_prometheus(self.METRICS_FILE)
+        metrics.write_json(self.METRICS_SNAPSHOT_FILE)
\ No newline at end of file
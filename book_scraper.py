@@ -2,19 +2,49 @@ import time
 from dotenv import load_dotenv
 import os
 from openai import OpenAI
-import pandas as pd
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from file_handler import rename_file, move_file, convert_to_epub
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
+from chrome_profile import chrome_options, block_resources
+from file_handler import rename_file, convert_to_epub
+from file_validator import validate_book
 from libgen_api import LibgenSearch
+from libgen_api.search_request import SearchRequest
 import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from icecream import ic
 from zlibrary import Zlibrary
+from mirror_health import MirrorHealthTracker
+from link_resolver import LinkResolver
+from hedged_download import HedgedDownloader, md5_from_url
+from urllib.parse import urljoin
+from rate_limiter import rate_limiter, api_key_bucket
+from metrics import metrics
+from not_found_store import NotFoundStore
+from source_planner import SourcePlanner
+from staging import StagingArea
+from delivery_log import DeliveryLog
+from records import Candidate, MIRROR_COLUMNS
+import deadline
+from deadline import Deadline, DeadlineExceeded
 from isbntools.app import isbn_from_words
 from isbnlib import meta
 
 
+LIBGEN_SEARCH_URL = 'https://libgen.is/search.php'
+LIBGEN_SEARCH_TIMEOUT = 30
+
+
+def _get_libgen_search_page(search_request):
+    # libgen_api fetches its results page with a bare requests.get, which can hang forever, so
+    # the page is fetched through the rate limiter with a timeout capped by the job's deadline
+    params = {'req': search_request.query, 'column': search_request.search_type}
+    return rate_limiter.request('GET', LIBGEN_SEARCH_URL, params=params, timeout=LIBGEN_SEARCH_TIMEOUT)
+
+
+SearchRequest.get_search_page = _get_libgen_search_page
+
 
 class BookScraper:
     """
@@ -22,20 +52,70 @@ class BookScraper:
     """
 
     MIRROR_SOURCES = ["GET"]
-    MIRROR_LIST = ['Mirror_1', 'Mirror_2', 'Mirror_3']
-
-    def __init__(self):
+    MIRROR_PAGE_TIMEOUT = 20
+    ZLIBRARY_MAX_PAGES = 3
+    ZLIBRARY_HOST = 'zlibrary'
+    SPECULATIVE_CANDIDATES = 3
+    LLM_TIMEOUT = 30
+    METADATA_TIMEOUT = 30
+    PAGE_LOAD_TIMEOUT = 60
+    ELEMENT_TIMEOUT = 30
+    DOWNLOAD_START_TIMEOUT = 30
+    DOWNLOAD_POLL_INTERVAL = 0.25
+    MANUAL_DOWNLOAD_XPATH = '//*[@id="main"]/tbody/tr[1]/td[2]/a'
+    DELIVERY_MODES = ('download', 'kindle')
+
+    def __init__(self, client=None, zlibrary=None, mirror_health=None, hedged=False, segmented=False, not_found=None,
+                 delivery_mode='download', delivery_log=None, optimizer=None, link_resolver=None,
+                 budget=Deadline.TOTAL_BUDGET, lean_browser=True):
         """
         Initializes the BookScraper object.
-        """
+        :param client: An already configured OpenAI client to reuse, if any.
+        :param zlibrary: An already logged-in Zlibrary session to reuse, if any.
+        :param mirror_health: A shared MirrorHealthTracker to reuse, if any.
+        :param hedged: Download mirror links over HTTP, hedging across mirrors, instead of with Chrome.
+        :param segmented: In hedged mode, split the download into byte ranges across mirrors
+            that serve the same MD5.
+        :param not_found: A shared NotFoundStore to reuse, if any.
+        :param delivery_mode: 'download' to download Z-Library matches into the books directory,
+            or 'kindle' to have Z-Library send them straight to the account's Kindle address.
+        :param delivery_log: A shared DeliveryLog to record Kindle deliveries in, if any.
+        :param optimizer: An EpubOptimizer to shrink downloaded books with before they are moved
+            into the books directory, if any.
+        :param link_resolver: A shared LinkResolver to resolve mirror pages with, if any.
+        :param budget: The total time in seconds a single book may take, see Deadline.
+        :param lean_browser: Run Chrome without extensions, background networking, images,
+            stylesheets, fonts and known ad and analytics hosts, see chrome_profile.
+        """
+        if delivery_mode not in self.DELIVERY_MODES:
+            raise ValueError(f"Unknown delivery mode '{delivery_mode}', expected one of {self.DELIVERY_MODES}")
         ic.configureOutput(includeContext=True)
         load_dotenv()  # This loads the .env file
-        self._client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        self._download_dir = "Downloads/"
+        self._client = client if client is not None else OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self._openai_bucket = api_key_bucket('openai', self._client.api_key)
+        self._staging = StagingArea()
+        self._staging.collect_garbage()
+        self._download_dir = self._staging.root
         self._books_dir = "Books/"
-        self._options = webdriver.ChromeOptions()
+        self._lean_browser = lean_browser
         self._driver = None
-        self._Z = Zlibrary(email=os.getenv("GMAIL"),password=os.getenv("ZLIBRARY_PASSWORD"))   
+        self._mirror_health = mirror_health if mirror_health is not None else MirrorHealthTracker()
+        self._planner = SourcePlanner(self._mirror_health)
+        self._link_resolver = link_resolver if link_resolver is not None else LinkResolver(timeout=self.MIRROR_PAGE_TIMEOUT)
+        self._hedged = hedged
+        self._segmented = segmented
+        self._downloader = HedgedDownloader() if hedged else None
+        self._not_found = not_found if not_found is not None else NotFoundStore()
+        self._requested_name = None
+        self._delivery_mode = delivery_mode
+        self._delivery_log = delivery_log if delivery_log is not None else DeliveryLog()
+        self._optimizer = optimizer
+        self._budget = budget
+        self._prefetch = ThreadPoolExecutor(max_workers=self.SPECULATIVE_CANDIDATES * len(MIRROR_COLUMNS),
+                                            thread_name_prefix='link-prefetch')
+        self._speculative_links = {}
+        self._lookups = ThreadPoolExecutor(max_workers=2, thread_name_prefix='metadata-lookup')
+        self._Z = zlibrary if zlibrary is not None else Zlibrary(email=os.getenv("GMAIL"),password=os.getenv("ZLIBRARY_PASSWORD"))
     
     def _enable_download_headless(self):
         """
@@ -47,71 +127,88 @@ class BookScraper:
 
     def _initialize_driver(self):
         """
-        Initialize the Chrome webdriver.
-        """
-        self._options.add_argument("--headless")
-        self._options.add_argument("--window-size=1920x1080")
-        self._options.add_argument("--disable-notifications")
-        self._options.add_argument('--no-sandbox')
-        self._options.add_argument('--verbose')
-        self._options.add_experimental_option("prefs", {
-            "download.default_directory": self._download_dir,
-            "download.prompt_for_download": False,
-            "download.directory_upgrade": True,
-            "safebrowsing_for_trusted_sources_enabled": False,
-            "safebrowsing.enabled": False
-        })
-        self._options.add_argument('--disable-gpu')
-        self._options.add_argument('--disable-software-rasterizer')
-        self._driver = webdriver.Chrome(options=self._options)
+        Initialize the Chrome webdriver, quitting the previous one if it is still running. In
+        lean mode, non-essential requests are blocked before the first page is loaded.
+        """
+        self._quit_driver()
+        self._driver = webdriver.Chrome(options=chrome_options(self._download_dir, lean=self._lean_browser))
+        self._driver.set_page_load_timeout(deadline.timeout(self.PAGE_LOAD_TIMEOUT))
         self._enable_download_headless()
+        if self._lean_browser:
+            block_resources(self._driver)
+
+    def _quit_driver(self):
+        """
+        Quit the Chrome webdriver if it is running.
+        """
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            except Exception as e:
+                ic(f"Could not quit Chrome: {e}")
+            self._driver = None
 
     def _search_titles_libgen(self, book_name, metadata=None):
         """
         Search for book titles on Libgen based on the given book name.
+
+        Every format the planner can handle is kept, so that the cheapest copy of the book can
+        be chosen once it has been identified. libgen_api filters a single results page on the
+        client side, so one search per author covers all formats.
+
         :param book_name: The name of the book to search for.
-        :return: A DataFrame containing the search results.
+        :return: A list of Candidates, one per search result.
         """
         tf = LibgenSearch()
-        title_filters = [
-            {"Extension": "epub", "Language": "English"}, 
-            {"Extension": "mobi", "Language": "English"},
-            {"Extension": "azw3", "Language": "English"}
-        ]
+        title_filter = {"Language": "English"}
         titles = []
 
         authors = metadata.get("Authors", [None]) if metadata else [None]
         book_name = metadata.get("Title", book_name) if metadata else book_name
 
-        for filter in title_filters:
-            for author in authors:
-                search_term = f"{book_name} {author}" if author else book_name
-                titles = tf.search_title_filtered(search_term, filter)
-                if titles:
-                    break
+        for author in authors:
+            search_term = f"{book_name} {author}" if author else book_name
+            with deadline.stage('search'), metrics.timer('libgen_search', source='libgen'):
+                try:
+                    titles = tf.search_title_filtered(search_term, title_filter)
+                except requests.RequestException as e:
+                    deadline.check()  # The job ran out of time rather than Libgen
+                    ic(f"Searching Libgen for '{search_term}' failed: {e}")
+                    titles = []
+            titles = [title for title in titles if str(title.get("Extension", "")).lower() in SourcePlanner.FORMATS]
             if titles:
                 break
 
-        books = pd.DataFrame(titles)
-        if not books.empty:
-            books = books[["Title", "Mirror_1", "Mirror_2", "Mirror_3"]]
-
-        return books
+        return [Candidate.from_result(title) for title in titles]
     
-    def _log_not_found_book(self, book_name):
+    def _lookup_metadata(self, book_name):
         """
-        Log the book that was not found in a CSV file.
+        Look up the metadata of a book by its name. isbnlib takes no timeout, so the lookup runs
+        on a worker thread and is given up on when it outlives the search stage.
+        :param book_name: The name of the book.
+        :return: The metadata, or None if there is none or the lookup took too long.
+        """
+        def lookup():
+            isbn = rate_limiter.call('isbn', isbn_from_words, book_name)
+            return rate_limiter.call('isbn', meta, isbn)
+
+        future = self._lookups.submit(deadline.bind(lookup))
+        try:
+            return future.result(timeout=deadline.timeout(self.METADATA_TIMEOUT))
+        except FutureTimeoutError:
+            deadline.check()
+            ic(f"Looking up the metadata of '{book_name}' timed out.")
+            return None
+
+    def _log_not_found_book(self, book_name, transient=False):
+        """
+        Record the book that was not found in the not-found store, keyed by the title that was
+        originally requested, so that it is skipped until its negative-cache entry expires.
         :param book_name: The name of the book that was not found.
+        :param transient: The book was found but could not be downloaded, see NotFoundStore.
         """
         ic(f"Could not find the book '{book_name}'.")
-        not_found_books = pd.DataFrame([book_name], columns=['Book Name'])
-
-        # If the CSV file already exists, append the DataFrame to it
-        if os.path.exists('Logs/not_found_books.csv'):
-            not_found_books.to_csv('not_found_books.csv', mode='a', header=False, index=False)
-        # If the CSV file does not exist, create it
-        else:
-            not_found_books.to_csv('Logs/not_found_books.csv', index=False)
+        self._not_found.record_miss(self._requested_name or book_name, transient=transient)
 
     def _is_desired_book(self, book_name, book_title):
         """
@@ -122,8 +219,7 @@ class BookScraper:
         :return: True if the book_title is the desired book, False otherwise.
         """
         prompt = f"I am searching for the book '{book_name}'. Is '{book_title}' the book I am looking for and is it in English?"
-        completion = self._client.chat.completions.create(model="gpt-3.5-turbo",
-        messages=[
+        messages = [
             {"role": "system", 
              "content": """
              You are a highly knowledgeable assistant with expertise in books. Your task is to carefully compare two specific books. 
@@ -134,14 +230,20 @@ class BookScraper:
              """
              },
             {"role": "user", "content": prompt}
-        ])
+        ]
+        with deadline.stage('match'), metrics.timer('llm_match', source='openai'):
+            completion = rate_limiter.call('api.openai.com', self._client.chat.completions.create, key=self._openai_bucket,
+                                           model="gpt-3.5-turbo", messages=messages,
+                                           timeout=deadline.timeout(self.LLM_TIMEOUT))
         response = completion.choices[0].message.content
         return 'yes' in response.lower()
     
-    def _backup_download(self, book_name, metadata=None):
+    def _backup_download(self, book_name, metadata=None, transient=False):
         """
         Backup download method to use if the main download method fails.
         :param book_name: The name of the book to download.
+        :param transient: Libgen has the book but could not serve it, so a miss on Z-Library
+            is only cached briefly.
         """
         ic(f"Searching for the '{book_name}' with Z-Library instead ...")
 
@@ -150,101 +252,318 @@ class BookScraper:
 
         for author in authors:
             search_term = f"{book_name} {author}" if author else book_name
-            results = self._Z.search(message=search_term, languages=["English"], extensions="epub")["books"]
-            books = pd.DataFrame(results)
-            ic(books)
-
-            book_to_download = next((row for _, row in books.iterrows() if self._is_desired_book(book_name, row["title"])), None)
+            book_to_download = self._search_zlibrary(book_name, search_term)
+            if book_to_download is None:
+                continue
+            delivered, book_path = self._deliver_zlibrary_book(book_name, book_to_download)
+            if delivered:
+                return book_path
+
+        self._log_not_found_book(book_name, transient=transient)
+        return None
 
-            if book_to_download is not None:
-                _, content = self._Z.downloadBook(book=book_to_download)
-                with open(f"{self._books_dir}/{book_name}", "wb") as f:
-                    f.write(content)
-                ic(f"Successfully downloaded the book '{book_name}'.")
-                break
+    def _search_zlibrary(self, book_name, search_term):
+        """
+        Search Z-Library for the book and choose the cheapest format of the first match that is
+        available in a format that can be converted to EPUB.
+        :param book_name: The name of the book to search for.
+        :param search_term: The search query.
+        :return: The Z-Library book to download, or None if not found.
+        """
+        with deadline.stage('search'):
+            results = self._Z.iterSearch(message=search_term, languages=["English"], maxPages=self.ZLIBRARY_MAX_PAGES)
+            try:
+                for book in results:
+                    if not self._is_desired_book(book_name, book["title"]):
+                        continue
+                    book = self._planner.choose_zlibrary(self._Z, book, self.ZLIBRARY_HOST)
+                    if book is not None:
+                        return book
+                return None
+            finally:
+                results.close()
+
+    def _deliver_zlibrary_book(self, book_name, book):
+        """
+        Deliver a Z-Library book: send it to the Kindle in kindle mode, otherwise download it,
+        convert it to EPUB if needed and move it into the books directory.
+        :param book_name: The name of the book.
+        :param book: The Z-Library book.
+        :return: A tuple of whether the book was delivered and the path of the downloaded book.
+        """
+        if self._delivery_mode == 'kindle':
+            with deadline.stage('deliver'):
+                if not self._send_to_kindle(book_name, book):
+                    return False, None
+            self._not_found.record_found(self._requested_name or book_name)
+            return True, None
+
+        with deadline.stage('download'):
+            downloaded = self._Z.downloadBook(book=book)
+        if downloaded is None:
+            return False, None
+        file_name, content = downloaded
+        file_path = os.path.join(self._download_dir, book_name + os.path.splitext(file_name)[1])
+        with open(file_path, "wb") as f:
+            f.write(content)
+        if not self._accept_download(file_path):
+            return False, None
+        if not file_path.endswith('.epub'):
+            with deadline.stage('convert'):
+                epub_path = os.path.splitext(file_path)[0] + '.epub'
+                # A failed conversion keeps the original, which is delivered as it is
+                if convert_to_epub(file_path, self._download_dir) and os.path.exists(epub_path):
+                    file_path = epub_path
+        if self._optimizer is not None:
+            self._optimizer.optimize(file_path)
+        book_path = self._staging.commit(file_path, self._books_dir)
+        ic(f"Successfully downloaded the book '{book_name}'.")
+        self._not_found.record_found(self._requested_name or book_name)
+        return True, book_path
+
+
+    def _send_to_kindle(self, book_name, book):
+        """
+        Have Z-Library send a book straight to the account's Kindle address, skipping the local
+        download and the email upload, and record the outcome in the delivery log.
+        :param book_name: The name of the book.
+        :param book: The Z-Library search result of the book.
+        :return: True if Z-Library accepted the delivery, False otherwise.
+        """
+        with metrics.timer('zlibrary_send_to_kindle', source='zlibrary'):
+            response = self._Z.sendTo(book["id"], book["hash"], "kindle")
+        sent = bool(response and response.get("success"))
+        self._delivery_log.record(
+            book=book_name,
+            recipient=self._Z.getKindleEmail(),
+            channel='zlibrary-kindle',
+            status=DeliveryLog.SENT if sent else DeliveryLog.FAILED,
+            detail=None if sent else (response or {}).get("error"),
+        )
+        if sent:
+            ic(f"Z-Library is sending '{book_name}' to your Kindle.")
         else:
-            self._log_not_found_book(book_name)
-            
-        
-        
+            ic(f"Z-Library could not send '{book_name}' to your Kindle.")
+        return sent
 
     def _search_book(self, books, book_name):
         """
-        Search for a specific book in the given DataFrame of books.
-        :param books: The DataFrame containing the books.
+        Search for a specific book in the given search results.
+
+        Every distinct title is checked once. While the first candidates are being judged, the
+        download links of their cheapest copies are resolved in the background, so the download
+        can start as soon as one is accepted. The copies of the matching title, in any format,
+        are returned cheapest first, followed by those whose mirrors are all unavailable.
+
+        :param books: The Candidates found by the search.
         :param book_name: The name of the book to search for.
-        :return: A DataFrame containing the details of the found book, or None if not found.
+        :return: A list of the Candidates that are copies of the found book, empty if none of them
+            can be converted, or None if not found.
         """
-        if books.empty:
-            self._backup_download(book_name)
-            return None
+        copies_by_title = {}
+        for book in books:
+            copies_by_title.setdefault(book.title, []).append(book)
+        candidates = [(book_title, self._planner.rank_libgen(copies)) for book_title, copies in copies_by_title.items()]
+        for _, copies in candidates[:self.SPECULATIVE_CANDIDATES]:
+            self._prefetch_download_links(copies)
 
-        for _, row in books.iterrows():
-            book_title = row["Title"]
+        for index, (book_title, copies) in enumerate(candidates):
             if self._is_desired_book(book_name, book_title):
                 ic(f"Found the book: '{book_name}'")
-                return pd.DataFrame([row])
+                return copies
 
             ic(f"'{book_title}' is not the book we are searching for.")
+            self._discard_download_links(copies, remaining=[copies for _, copies in candidates[index + 1:]])
 
         return None
     
-    def _wait_for_download_complete(self, timeout=300, check_interval=10):
+    def _download_native_zlibrary(self, book_name, libgen_copy):
+        """
+        Libgen only has the book in a format that needs converting, so check whether Z-Library
+        has a copy that is cheaper to fetch, such as a native EPUB, and deliver that instead.
+        :param book_name: The name of the book.
+        :param libgen_copy: The cheapest Libgen copy of the book.
+        :return: A tuple of whether the book was delivered and the path of the downloaded book.
+        """
+        zlibrary_book = self._search_zlibrary(book_name, book_name)
+        if zlibrary_book is None:
+            return False, None
+        zlibrary_cost = self._planner.zlibrary_cost(zlibrary_book, self.ZLIBRARY_HOST)
+        libgen_cost = self._planner.libgen_cost(libgen_copy)
+        if zlibrary_cost is None or zlibrary_cost >= libgen_cost:
+            return False, None
+        ic(f"Z-Library has '{book_name}' as {zlibrary_book.get('extension')}, which is cheaper than "
+           f"converting the {libgen_copy.extension} from Libgen.")
+        return self._deliver_zlibrary_book(book_name, zlibrary_book)
+
+    def _wait_for_download_start(self, timeout=DOWNLOAD_START_TIMEOUT):
+        """
+        Waits for a download to appear in the job directory, finished or in progress.
+        :param timeout: Maximum time to wait for the download to start, capped by the job's deadline.
+        :return: True if a download started, False otherwise.
+        """
+        timeout = deadline.timeout(timeout)
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            if not self._check_empty_folder():
+                return True
+            time.sleep(self.DOWNLOAD_POLL_INTERVAL)
+        deadline.check()
+        return False
+
+    def _wait_for_download_complete(self, timeout=300, check_interval=1):
         """
         Waits for a file to download in the specified directory, using the .crdownload extension.
-        :param timeout: Maximum time to wait for the download to complete.
+        :param timeout: Maximum time to wait for the download to complete, capped by the job's deadline.
         :param check_interval: Interval to check for download completion.
         :return: True if download is completed, False otherwise.
         """
+        timeout = deadline.timeout(timeout)
         start_time = time.time()
 
         while time.time() - start_time < timeout:
             # Check if there is a .crdownload file in the directory
             if any(file.endswith('.crdownload') for file in os.listdir(self._download_dir)):
-                time.sleep(check_interval)
+                time.sleep(max(0, min(check_interval, timeout - (time.time() - start_time))))
             else:
                 # No .crdownload file found, download is complete
                 return True
 
+        deadline.check()  # The job ran out of time rather than this mirror
         return False  # Timed out
     
+    def _timed_resolve_download_links(self, link, speculative=False):
+        start_time = time.time()
+        # Prefetches run alongside the job and may be thrown away, so they are only limited by
+        # its total budget and not charged to the resolve stage
+        links = self._link_resolver.resolve(link) if speculative else self._resolve_download_links(link)
+        return links, time.time() - start_time
+
+    def _prefetch_download_links(self, copies):
+        """
+        Start resolving the download links of the cheapest copy of a candidate in the background,
+        so that they are ready by the time the candidate has been judged.
+        :param copies: The ranked copies of the candidate.
+        """
+        for url in self._speculative_urls(copies):
+            if url not in self._speculative_links:
+                self._speculative_links[url] = self._prefetch.submit(
+                    deadline.bind(self._timed_resolve_download_links), url, speculative=True)
+
+    def _speculative_urls(self, copies):
+        """
+        Return the mirror page URLs that are prefetched for a candidate, best mirror first.
+        """
+        if not copies:
+            return []
+        urls = copies[0].links.by_column()
+        return [urls[mirror] for mirror in self._mirror_health.rank(urls)]
+
+    def _discard_download_links(self, copies, remaining=()):
+        """
+        Drop the speculative work for a rejected candidate, cancelling what has not started yet.
+        :param copies: The ranked copies of the candidate.
+        :param remaining: The ranked copies of the candidates still to be judged, whose mirror
+            pages are kept even if the rejected candidate shares them.
+        """
+        keep = {url for other in remaining for url in self._speculative_urls(other)}
+        for url in self._speculative_urls(copies):
+            if url in keep:
+                continue
+            future = self._speculative_links.pop(url, None)
+            if future is not None:
+                future.cancel()
+                metrics.inc('speculative_links_total', outcome='discarded')
+
+    def _discard_all_download_links(self):
+        """
+        Drop the speculative work that is left once a job is done.
+        """
+        for future in self._speculative_links.values():
+            future.cancel()
+            metrics.inc('speculative_links_total', outcome='discarded')
+        self._speculative_links.clear()
+
+    def _take_download_links(self, link):
+        """
+        Return the download links of a mirror page, using the speculatively resolved ones if
+        they were prefetched.
+        :param link: The link to the webpage.
+        :return: A tuple of the download links and the seconds it took to resolve them.
+        """
+        future = self._speculative_links.pop(link, None)
+        if future is None or future.cancelled():
+            return self._timed_resolve_download_links(link)
+        metrics.inc('speculative_links_total', outcome='used')
+        return future.result()
+
     def _resolve_download_links(self, link):
         """
-        Resolve the download links from the given webpage link.
+        Resolve the download links from the given webpage link, through the link resolver's cache.
         :param link: The link to the webpage.
         :return: A dictionary containing the download links.
         """
- 
-        page = requests.get(link)
-        soup = BeautifulSoup(page.text, "html.parser")
-        links = soup.find_all("a", string=self.MIRROR_SOURCES)
-        download_links = {link.string: link["href"] for link in links if link.string == "GET"}
-        return download_links
+        with deadline.stage('resolve'):
+            return self._link_resolver.resolve(link)
     
     def _file_cleanup(self, book_name):
         """
-        Perform cleanup operations on the downloaded file.
+        Perform cleanup operations on the downloaded file of the current job: rename it after
+        the book, convert it to EPUB inside the job directory if needed, optimize it if an
+        optimizer is set, and atomically move the result into the books directory.
         :param book_name: The name of the book.
+        :return: The path of the book in the books directory, or None if nothing was downloaded.
         """
 
-        file_name = os.listdir(self._download_dir)[0]
-        file_path = rename_file(os.path.join(self._download_dir, file_name), book_name)
+        finished = self._staging.finished_files(self._download_dir)
+        if not finished:
+            ic(f"No downloaded file found for '{book_name}'.")
+            return None
+
+        if not self._accept_download(os.path.join(self._download_dir, finished[0])):
+            return None
+        file_path = rename_file(os.path.join(self._download_dir, finished[0]), book_name)
         
         if not file_path.endswith('.epub'):
-            if convert_to_epub(file_path, self._books_dir):
-                ic(f"Successfully converted and moved {book_name}")
-            else:
-                move_file(file_path, self._books_dir)
-        else:
-            move_file(file_path, self._books_dir)
+            with deadline.stage('convert'):
+                epub_path = os.path.splitext(file_path)[0] + '.epub'
+                # A failed conversion keeps the original, which is delivered as it is
+                if convert_to_epub(file_path, self._download_dir) and os.path.exists(epub_path):
+                    ic(f"Successfully converted {book_name}")
+                    file_path = epub_path
+        if self._optimizer is not None:
+            self._optimizer.optimize(file_path)
+        return self._staging.commit(file_path, self._books_dir)
+
+    def _accept_download(self, file_path, expected_md5=None):
+        """
+        Validate a downloaded file before it is converted or delivered, and delete it if it is
+        not the book it claims to be, see validate_book.
+        :param file_path: The path of the downloaded file.
+        :param expected_md5: The MD5 of the book from the Libgen listing, if known.
+        :return: True if the file was accepted, False if it was rejected and deleted.
+        """
+        reason = validate_book(file_path, expected_md5)
+        if reason is None:
+            return True
+        ic(f"Rejected the download '{os.path.basename(file_path)}': {reason}")
+        os.remove(file_path)
+        return False
 
     def _check_empty_folder(self):
         """
-        Perform cleanup operations on the downloaded file.
-        :param book_name: The name of the book.
+        Check whether the current job has not downloaded any file yet.
+        :return: True if the job directory holds no finished or partial download.
         """
 
-        return not bool(os.listdir(self._download_dir))
+        return not any(name != StagingArea.OWNER_FILE for name in os.listdir(self._download_dir))
+
+    def _downloaded_size(self):
+        """
+        Return the total size in bytes of the files in the download directory.
+        """
+        return sum(entry.stat().st_size for entry in os.scandir(self._download_dir)
+                   if entry.is_file() and entry.name != StagingArea.OWNER_FILE)
     
     def _process_download_link(self, download_link, book_name):
         """
@@ -255,116 +574,265 @@ class BookScraper:
 
         :param download_link: The link to download the book.
         :param book_name: The name of the book to be downloaded.
+        :return: The path of the downloaded book, or None if the download failed.
         """
         link = self._resolve_download_links(download_link)
         self._initialize_driver()
         self._driver.get(link['GET'])
-        time.sleep(4)
-        self._wait_for_download_complete()
-        self._driver.quit()
+        if self._wait_for_download_start():
+            self._wait_for_download_complete()
+        self._quit_driver()
 
-        self._file_cleanup(book_name)
+        return self._file_cleanup(book_name)
     
-    def _process_mirror_links(self, row, mirror_list):
+    def _process_mirror_links(self, links):
         """
         Processes a list of mirror links to download a book.
 
-        This method iterates over the mirror links, resolves each download link, initializes a 
-        web driver, navigates to the download link, waits for the download to complete, and 
-        checks if the download was successful. If a download was successful, it quits the driver 
-        and returns True. If none of the downloads were successful, it returns False.
+        This method orders the mirrors by their observed health, skipping hosts whose circuit
+        is open, then resolves each download link, navigates to it, waits for the download to
+        complete, and validates the downloaded file, deleting it if it is not a valid book.
+        Every attempt is recorded in the mirror health tracker. If a download was successful,
+        it quits the driver and returns True. If none of the downloads were successful, it
+        returns False.
 
-        :param row: The row in the DataFrame containing the download links.
-        :param mirror_list: The list of mirror links to process.
+        :param links: The MirrorLinks of the copy to download.
         :return: True if a download was successful, False otherwise.
         """
-        for mirror in mirror_list:
-            link = self._resolve_download_links(row[mirror])
-            self._driver.get(link['GET'])
-            time.sleep(4)
-            self._wait_for_download_complete()
-            if link and not self._check_empty_folder():
-                self._driver.quit()
-                return True
-        return False
+        urls = links.by_column()
+        expected_md5 = next((md5_from_url(url) for url in urls.values() if md5_from_url(url)), None)
+        try:
+            for mirror in self._mirror_health.rank(urls):
+                host = self._mirror_health.host_of(urls[mirror])
+                try:
+                    link, ttfb = self._take_download_links(urls[mirror])
+                except requests.RequestException as e:
+                    ic(f"Could not reach {host}: {e}")
+                    self._mirror_health.record_failure(host)
+                    continue
+                start_time = time.time() - ttfb
+
+                if 'GET' not in link:
+                    self._mirror_health.record_failure(host)
+                    continue
+
+                with metrics.timer('chrome_download', mirror=host):
+                    self._driver.get(link['GET'])
+                    completed = self._wait_for_download_start() and self._wait_for_download_complete()
+                finished = self._staging.finished_files(self._download_dir) if completed else []
+                accepted = [self._accept_download(os.path.join(self._download_dir, name), expected_md5)
+                            for name in finished]
+                if finished and all(accepted):
+                    size = self._downloaded_size()
+                    metrics.inc('bytes_downloaded_total', size, source='libgen', mirror=host)
+                    self._mirror_health.record_success(host, ttfb, size, time.time() - start_time)
+                    self._quit_driver()
+                    return True
+                self._mirror_health.record_failure(host)
+                self._link_resolver.invalidate(urls[mirror])
+            return False
+        finally:
+            self._mirror_health.save()
+
+    def _process_mirror_links_hedged(self, links):
+        """
+        Processes a list of mirror links to download a book over HTTP, hedging across mirrors.
+
+        This method resolves the GET link of every available mirror, best first, and hands them
+        to the hedged downloader, which starts on the best mirror and races the next one when
+        the current download stalls. A downloaded file that fails validation is deleted and the
+        remaining mirrors are tried. The outcome of every mirror is recorded in the mirror
+        health tracker.
+
+        :param links: The MirrorLinks of the copy to download.
+        :return: True if a download was successful, False otherwise.
+        """
+        urls = links.by_column()
+        get_links = {}
+        pages = {}
+        try:
+            for mirror in self._mirror_health.rank(urls):
+                host = self._mirror_health.host_of(urls[mirror])
+                try:
+                    link, _ = self._take_download_links(urls[mirror])
+                except requests.RequestException as e:
+                    ic(f"Could not reach {host}: {e}")
+                    self._mirror_health.record_failure(host)
+                    continue
+                if 'GET' in link:
+                    get_links[urljoin(urls[mirror], link['GET'])] = host
+                    pages[urljoin(urls[mirror], link['GET'])] = urls[mirror]
+                else:
+                    self._mirror_health.record_failure(host)
+
+            if not get_links:
+                return False
+
+            expected_md5 = next((md5_from_url(url) for url in urls.values() if md5_from_url(url)), None)
+            while get_links:
+                with metrics.timer('http_download', source='libgen'):
+                    if self._segmented and expected_md5:
+                        result = self._downloader.download_segmented(get_links, self._download_dir, expected_md5)
+                    else:
+                        result = self._downloader.download(get_links, self._download_dir, expected_md5)
+
+                for url in set(result['failed'] if result else get_links):
+                    self._mirror_health.record_failure(get_links[url])
+                    self._link_resolver.invalidate(pages[url])
+                if result is None:
+                    return False
+                # The downloader has already verified the MD5, so only the file's structure is checked
+                if self._accept_download(result['path']):
+                    metrics.inc('bytes_downloaded_total', result['size'], source='libgen', mirror=get_links[result['url']])
+                    self._mirror_health.record_success(get_links[result['url']], result['ttfb'], result['size'], result['duration'])
+                    return True
+                if expected_md5:
+                    # Every mirror serves the same bytes, so the listed file itself is broken
+                    return False
+                self._mirror_health.record_failure(get_links[result['url']])
+                self._link_resolver.invalidate(pages[result['url']])
+                get_links = {url: host for url, host in get_links.items()
+                             if url != result['url'] and url not in result['failed']}
+            return False
+        finally:
+            self._mirror_health.save()
 
     def _process_download_links(self, download_links, book_name):
         """
-        Processes a DataFrame of download links to download a book.
+        Processes a list of download links to download a book.
 
-        This method initializes a web driver, iterates over the download links, and processes 
-        each link using a list of mirror links. If a download is successful, it breaks the loop 
-        and cleans up the files. If no download is successful, it still cleans up the files.
+        This method iterates over the download links and processes each link using a list of
+        mirror links, either over HTTP in hedged mode or through a web driver otherwise. If a
+        download is successful, it breaks the loop and cleans up the files. If no download is
+        successful, it still cleans up the files.
 
-        :param download_links: A DataFrame containing the download links.
+        :param download_links: A list of MirrorLinks, one per copy, best first.
         :param book_name: The name of the book to be downloaded.
+        :return: The path of the downloaded book, or None if the download failed.
         """
-        self._initialize_driver()
-        for _, row in download_links.iterrows():
-            if self._process_mirror_links(row, self.MIRROR_LIST):
-                break
+        if self._hedged:
+            for links in download_links:
+                if self._process_mirror_links_hedged(links):
+                    break
+        else:
+            self._initialize_driver()
+            for links in download_links:
+                if self._process_mirror_links(links):
+                    break
 
-        self._file_cleanup(book_name)
+        return self._file_cleanup(book_name)
 
     def _auto_download_book(self, book_name, download_links=None, download_link=None):
         """
         Automatically download the book using the provided download links or download link.
         :param book_name: The name of the book.
-        :param download_links: A DataFrame containing the download links.
+        :param download_links: A list of MirrorLinks, one per copy, best first.
         :param download_link: The direct download link.
+        :return: The path of the downloaded book, or None if the download failed.
         """
-        if download_link:
-            self._process_download_link(download_link, book_name)
-        elif not download_links.empty:
-            self._process_download_links(download_links, book_name)
-                        
-        else:
-            self._log_not_found_book(book_name)
+        with deadline.stage('download'):
+            if download_link:
+                return self._process_download_link(download_link, book_name)
+            elif download_links:
+                return self._process_download_links(download_links, book_name)
+
+        self._log_not_found_book(book_name)
+        return None
     
     def _download_book_manually(self, book_name, download_link):
         """
         Download the book manually using the provided download link.
         :param book_name: The name of the book.
         :param download_link: The direct download link.
+        :return: The path of the downloaded book, or None if the download failed.
         """
 
         self._initialize_driver()
         ic(f"Downloading the book '{book_name}'...")
         self._driver.get(download_link)
-        time.sleep(10)
 
-        download_link = self._driver.find_element(By.XPATH, '//*[@id="main"]/tbody/tr[1]/td[2]/a')
+        wait = WebDriverWait(self._driver, deadline.timeout(self.ELEMENT_TIMEOUT))
+        download_link = wait.until(expected_conditions.element_to_be_clickable((By.XPATH, self.MANUAL_DOWNLOAD_XPATH)))
         download_link.click()
-        time.sleep(10)
-        self._wait_for_download_complete()
-        self._driver.quit()
+        if self._wait_for_download_start():
+            self._wait_for_download_complete()
+        self._quit_driver()
 
-        self._file_cleanup(book_name)
+        return self._file_cleanup(book_name)
 
-    def scrape_book(self, book_name, download_link=None, download_links=None):
+    def scrape_book(self, book_name, download_link=None, download_links=None, force=False):
         """
         Scrape and download the book based on the provided book name and download link(s).
+
+        Every call downloads into its own staging directory, which is removed afterwards, so
+        several scrapers can download at the same time. Every call also runs under its own
+        Deadline: when the book or one of its stages runs out of time, the job is abandoned and
+        DeadlineExceeded is raised, naming the stage.
+
         :param book_name: The name of the book.
         :param download_link: The direct download link.
-        :param download_links: A DataFrame containing the download links.
+        :param download_links: A list of MirrorLinks, one per copy, best first.
+        :param force: Search for the book even if it was recently not found.
+        :return: The path of the downloaded book, or None if no book was downloaded.
+        """
+        with self._staging.job() as job_dir, deadline.activate(Deadline(self._budget)) as job_deadline:
+            self._download_dir = job_dir
+            try:
+                return self._scrape_book(book_name, download_link, download_links, force)
+            except DeadlineExceeded as e:
+                ic(f"Gave up on '{book_name}': {e}. Time spent per stage: {job_deadline.spent()}")
+                metrics.inc('deadline_exceeded_total', stage=e.stage)
+                self._quit_driver()
+                raise
+            finally:
+                self._download_dir = self._staging.root
+
+    def _scrape_book(self, book_name, download_link, download_links, force):
+        """
+        Scrape and download the book into the current job directory. See scrape_book.
         """
-
-        
         if download_link:
-            self._auto_download_book(book_name=book_name, download_link=download_link)
-        elif download_links is not None and not download_links.empty:
-            self._auto_download_book(book_name=book_name, download_links=download_links)
-        else:
-            ic(f"Searching for the book '{book_name}'...")
-            metadata = meta(isbn_from_words(book_name))
+            return self._auto_download_book(book_name=book_name, download_link=download_link)
+        elif download_links:
+            return self._auto_download_book(book_name=book_name, download_links=download_links)
+        elif not force and self._not_found.is_known_miss(book_name):
+            ic(f"Skipping '{book_name}', it was not found recently.")
+            return None
+
+        ic(f"Searching for the book '{book_name}'...")
+        self._requested_name = book_name
+        try:
+            with deadline.stage('search'), metrics.timer('metadata', source='isbn'):
+                metadata = self._lookup_metadata(book_name)
             book_name = metadata.get("Title", book_name) if metadata else book_name
             books = self._search_titles_libgen(book_name, metadata=metadata)
-            book = self._search_book(books, book_name)
-
-            if book is not None:
-                book_name = book['Title'].values[0]
-                links = book[['Mirror_1', 'Mirror_2', 'Mirror_3']]
-                self._auto_download_book(book_name=book_name, download_links=links)
-
+            if not books:
+                return self._backup_download(book_name)
 
-        
+            book = self._search_book(books, book_name)
+            if book is None:
+                self._log_not_found_book(book_name)
+                return None
+            if not book or self._planner.libgen_cost(book[0]) is None:
+                # Libgen has the book, but not in a format that can be converted or not on a
+                # mirror that is up
+                return self._backup_download(book_name, transient=bool(book))
+
+            book_name = book[0].title
+            if book[0].extension != SourcePlanner.NATIVE_FORMAT:
+                delivered, book_path = self._download_native_zlibrary(book_name, book[0])
+                if delivered:
+                    return book_path
+
+            links = [copy.links for copy in book]
+            book_path = self._auto_download_book(book_name=book_name, download_links=links)
+            if book_path is not None:
+                self._not_found.record_found(self._requested_name)
+            else:
+                # Every copy failed to download, which is likely to pass, so the book is only
+                # skipped and re-checked for a short while
+                self._log_not_found_book(book_name, transient=True)
+            return book_path
+        finally:
+            self._requested_name = None
+            self._discard_all_download_links()
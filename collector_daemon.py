@@ -0,0 +1,265 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from urllib.parse import urlparse
+
+import pandas as pd
+from dotenv import load_dotenv
+from icecream import ic
+from openai import OpenAI
+
+from book_scraper import BookScraper
+from mirror_health import MirrorHealthTracker
+from link_resolver import LinkResolver
+from rate_limiter import rate_limiter
+from metrics import metrics
+from not_found_store import NotFoundStore, RetryScheduler
+from delivery_log import DeliveryLog
+from deadline import DeadlineExceeded
+from request_normalizer import group_requests, request_key
+from records import MirrorLinks
+from single_flight import SingleFlight
+from epub_optimizer import EpubOptimizer
+from zlibrary import Zlibrary
+
+
+class CollectorDaemon:
+    """
+    A long-running collector that keeps its expensive resources warm and accepts jobs over a
+    local HTTP API.
+
+    The OpenAI client, the logged-in Z-Library session, the mirror health tracker and the
+    not-found store are created once and shared by every worker. Each worker thread lazily builds
+    its own BookScraper on top of them, since a scraper holds per-download browser state. Books
+    that were not found are re-checked in the background by a RetryScheduler.
+
+    Endpoints:
+        POST /jobs       JSON body {"title": ...} or {"title": ..., "link": ...}
+        POST /jobs/csv   CSV body with Title, Mirror_1, Mirror_2 and Mirror_3 columns
+        GET  /jobs       Status of every job
+        GET  /jobs/<id>  Status of a single job
+        GET  /limits     Current state of the outbound rate limits
+        GET  /metrics    Stage metrics in the Prometheus text format
+        GET  /metrics.json  Stage metrics as a JSON snapshot
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, workers=2, hedged=False, delivery_mode='download', optimize=False):
+        """
+        Initializes the CollectorDaemon object.
+        :param host: The interface to bind the HTTP API to.
+        :param port: The port to bind the HTTP API to.
+        :param workers: The number of jobs processed concurrently.
+        :param hedged: Download mirror links over HTTP, hedging across mirrors, instead of with Chrome.
+        :param delivery_mode: 'download' or 'kindle', see BookScraper.
+        :param optimize: Recompress downloaded EPUBs and downsample their images.
+        """
+        load_dotenv()
+        self.host = host
+        self.port = port
+        self.hedged = hedged
+        self.delivery_mode = delivery_mode
+        self._delivery_log = DeliveryLog()
+        self._optimizer = EpubOptimizer() if optimize else None
+        self._client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self._Z = Zlibrary(email=os.getenv("GMAIL"), password=os.getenv("ZLIBRARY_PASSWORD"))
+        self._mirror_health = MirrorHealthTracker()
+        self._link_resolver = LinkResolver(timeout=BookScraper.MIRROR_PAGE_TIMEOUT)
+        self._not_found = NotFoundStore()
+        self._retry_scheduler = RetryScheduler(self._not_found, retry=self._retry_not_found)
+        self._single_flight = SingleFlight()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='collector')
+        self._local = threading.local()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _get_scraper(self):
+        """
+        Return the BookScraper owned by the current worker thread, creating it on first use.
+        """
+        scraper = getattr(self._local, 'scraper', None)
+        if scraper is None:
+            scraper = BookScraper(client=self._client, zlibrary=self._Z, mirror_health=self._mirror_health,
+                                  hedged=self.hedged, not_found=self._not_found,
+                                  delivery_mode=self.delivery_mode, delivery_log=self._delivery_log,
+                                  optimizer=self._optimizer, link_resolver=self._link_resolver)
+            self._local.scraper = scraper
+        return scraper
+
+    def _retry_not_found(self, book_name):
+        """
+        Search again for a book that was not found, on the retry scheduler's thread.
+        """
+        self._get_scraper().scrape_book(book_name, force=True)
+
+    def _update_job(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _run_job(self, job_id, book_name, download_link=None, download_links=None):
+        """
+        Process a single job on a worker thread and record its outcome.
+
+        Jobs for the same book that run at the same time share one search and download, and
+        every one of them records its result.
+        """
+        self._update_job(job_id, status='running', started=time.time())
+        try:
+            book_path, shared = self._single_flight.do(
+                request_key(book_name), self._get_scraper().scrape_book, book_name,
+                download_link=download_link, download_links=download_links)
+        except DeadlineExceeded as e:
+            ic(f"Job {job_id} for '{book_name}' timed out: {e}")
+            self._update_job(job_id, status='timed_out', error=str(e), stage=e.stage, finished=time.time())
+        except Exception as e:
+            ic(f"Job {job_id} for '{book_name}' failed: {e}")
+            self._update_job(job_id, status='failed', error=str(e), finished=time.time())
+        else:
+            self._update_job(job_id, status='done', result=book_path, shared=shared, finished=time.time())
+
+    def submit(self, kind, book_name, download_link=None, download_links=None):
+        """
+        Queue a job and return its id.
+        :param kind: The kind of job ('title', 'link' or 'csv').
+        :param book_name: The name of the book.
+        :param download_link: The direct download link, if any.
+        :param download_links: A list of MirrorLinks, one per copy, if any.
+        :return: The id of the queued job.
+        """
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._jobs[job_id] = {
+                'id': job_id,
+                'kind': kind,
+                'title': book_name,
+                'status': 'queued',
+                'submitted': time.time(),
+                'started': None,
+                'finished': None,
+                'error': None,
+                'result': None,
+                'shared': False,
+                'stage': None,
+            }
+        self._executor.submit(self._run_job, job_id, book_name, download_link, download_links)
+        return job_id
+
+    def submit_csv(self, csv_text):
+        """
+        Queue one job per book of a CSV upload. Rows asking for the same book are merged into a
+        single job, keeping the mirror URLs of every row.
+        :param csv_text: The CSV contents, in the same layout BookManager reads.
+        :return: The ids of the queued jobs.
+        """
+        books_csv = pd.read_csv(StringIO(csv_text))
+        job_ids = []
+        for rows in group_requests(books_csv.to_dict('records'), title_of=lambda row: row['Title']).values():
+            links = [MirrorLinks.from_row(row) for row in rows]
+            job_ids.append(self.submit('csv', rows[0]['Title'], download_links=links))
+        return job_ids
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list_jobs(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def _make_handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length', 0))
+                return self.rfile.read(length).decode() if length else ''
+
+            def do_GET(self):
+                path = urlparse(self.path).path.rstrip('/')
+                if path == '/jobs':
+                    self._send_json(200, daemon.list_jobs())
+                elif path == '/limits':
+                    self._send_json(200, rate_limiter.limits())
+                elif path == '/metrics':
+                    body = metrics.to_prometheus().encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                elif path == '/metrics.json':
+                    self._send_json(200, metrics.snapshot())
+                elif path.startswith('/jobs/'):
+                    job = daemon.get_job(path.split('/')[-1])
+                    if job is None:
+                        self._send_json(404, {'error': 'Unknown job'})
+                    else:
+                        self._send_json(200, job)
+                else:
+                    self._send_json(404, {'error': 'Not found'})
+
+            def do_POST(self):
+                path = urlparse(self.path).path.rstrip('/')
+                try:
+                    if path == '/jobs/csv':
+                        self._send_json(202, {'jobs': daemon.submit_csv(self._read_body())})
+                    elif path == '/jobs':
+                        payload = json.loads(self._read_body() or '{}')
+                        if not isinstance(payload, dict):
+                            self._send_json(400, {'error': 'Expected a JSON object'})
+                            return
+                        title = payload.get('title')
+                        if not title:
+                            self._send_json(400, {'error': "Missing 'title'"})
+                            return
+                        link = payload.get('link')
+                        job_id = daemon.submit('link' if link else 'title', title, download_link=link)
+                        self._send_json(202, {'jobs': [job_id]})
+                    else:
+                        self._send_json(404, {'error': 'Not found'})
+                except (ValueError, KeyError) as e:
+                    self._send_json(400, {'error': str(e)})
+
+            def log_message(self, format, *args):
+                ic(format % args)
+
+        return Handler
+
+    def serve_forever(self):
+        """
+        Start the HTTP API and block until interrupted.
+        """
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._retry_scheduler.start()
+        ic(f"Collector daemon listening on http://{self.host}:{self.port}")
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            ic("Shutting down the collector daemon ...")
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """
+        Stop accepting requests and wait for running jobs to finish.
+        """
+        self._retry_scheduler.stop()
+        if self._server is not None:
+            self._server.server_close()
+            self._server = None
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import threading
+import uuid
+
+from icecream import ic
+
+
+class CoverCache:
+    """
+    A size-bounded on-disk LRU cache of book cover images, keyed by cover path.
+
+    Reads refresh a file's modification time, so evicting the oldest modification times first
+    drops the least recently used covers once the cache grows beyond its size limit.
+    """
+
+    DIRECTORY = 'Covers/'
+    MAX_BYTES = 100 * 1024 * 1024
+
+    def __init__(self, directory=DIRECTORY, max_bytes=MAX_BYTES):
+        """
+        Initializes the CoverCache object.
+        :param directory: The directory the covers are stored in.
+        :param max_bytes: The maximum total size of the cached covers.
+        """
+        self._directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        extension = os.path.splitext(key)[1].lower()
+        if not extension or len(extension) > 5:
+            extension = '.img'
+        return os.path.join(self._directory, hashlib.sha1(key.encode()).hexdigest() + extension)
+
+    def get(self, key):
+        """
+        Return the cached cover for a key, or None on a miss.
+        :param key: The cover path.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def put(self, key, data):
+        """
+        Store a cover and evict the least recently used covers beyond the size limit.
+        :param key: The cover path.
+        :param data: The image bytes.
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self._directory):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            evicted = 0
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                evicted += 1
+            ic(f"Evicted {evicted} cover(s) from {self._directory}")
@@ -0,0 +1,194 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a book job runs out of time, naming the stage whose budget ran out.
+    """
+
+    def __init__(self, stage):
+        super().__init__(f"Ran out of time in the '{stage}' stage")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    A total time budget for one book job, split into per-stage budgets.
+
+    Every stage has its own budget for the whole job, shared by all the times the stage is
+    entered, and no stage may run past the end of the total budget. Time spent in a stage nested
+    in another one is only charged to the inner stage. Every thread is charged for the time it
+    spends in a stage, so speculative work running alongside the job, such as prefetching, is
+    kept out of stages and only limited by the total budget. Network and subprocess calls ask
+    the deadline for their timeout, so they never outlive it, and DeadlineExceeded is raised as
+    soon as the current stage or the job is out of time.
+    """
+
+    TOTAL_BUDGET = 15 * 60
+    STAGE_BUDGETS = {
+        'search': 90,
+        'match': 90,
+        'resolve': 60,
+        'download': 8 * 60,
+        'convert': 3 * 60,
+        'deliver': 2 * 60,
+    }
+
+    def __init__(self, budget=TOTAL_BUDGET, stage_budgets=None):
+        """
+        Initializes the Deadline object.
+        :param budget: The total budget of the job in seconds.
+        :param stage_budgets: The budget in seconds of every stage, by default STAGE_BUDGETS.
+        """
+        self._end = time.monotonic() + budget
+        self.stage_budgets = dict(self.STAGE_BUDGETS, **(stage_budgets or {}))
+        self._spent = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        # Every thread working for the job keeps its own stack of running stages
+        stack = getattr(self._local, 'stages', None)
+        if stack is None:
+            stack = self._local.stages = []
+        return stack
+
+    @property
+    def stage_name(self):
+        """
+        The name of the innermost stage running on this thread.
+        """
+        stack = self._stack()
+        return stack[-1][0] if stack else 'total'
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Run a block as a stage, limited by what is left of the stage's budget and of the total.
+        Entering a stage that is already running on this thread has no effect.
+        :param name: The name of the stage, a key of stage_budgets.
+        """
+        stack = self._stack()
+        if any(entry[0] == name for entry in stack):
+            yield self
+            return
+
+        start_time = time.monotonic()
+        with self._lock:
+            left = self.stage_budgets.get(name, float('inf')) - self._spent.get(name, 0.0)
+        entry = [name, start_time + left, 0.0]
+        stack.append(entry)
+        try:
+            self.check()
+            yield self
+        finally:
+            stack.pop()
+            elapsed = time.monotonic() - start_time
+            with self._lock:
+                # Time spent in nested stages was charged to them
+                self._spent[name] = self._spent.get(name, 0.0) + elapsed - entry[2]
+            if stack:
+                stack[-1][1] += elapsed
+                stack[-1][2] += elapsed
+
+    def spent(self):
+        """
+        Return the seconds spent in every stage so far.
+        """
+        with self._lock:
+            return dict(self._spent)
+
+    def remaining(self):
+        """
+        Return the seconds left in the current stage.
+        """
+        stack = self._stack()
+        end = min(self._end, stack[-1][1]) if stack else self._end
+        return end - time.monotonic()
+
+    def check(self):
+        """
+        Raise DeadlineExceeded if the current stage has run out of time.
+        """
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(self.stage_name)
+
+    def timeout(self, default=None):
+        """
+        Return the timeout for a call in the current stage: the time left, or the default if that
+        is shorter.
+        :param default: The timeout the call would use without a deadline, if any.
+        """
+        self.check()
+        remaining = self.remaining()
+        return remaining if default is None else min(default, remaining)
+
+
+_local = threading.local()
+
+
+def current():
+    """
+    Return the deadline of the job running on this thread, or None.
+    """
+    return getattr(_local, 'deadline', None)
+
+
+@contextmanager
+def activate(deadline):
+    """
+    Make a deadline the current one of this thread for the duration of a block.
+    """
+    previous = current()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+@contextmanager
+def stage(name):
+    """
+    Run a block as a stage of the current deadline, if there is one.
+    """
+    deadline = current()
+    if deadline is None:
+        yield None
+    else:
+        with deadline.stage(name):
+            yield deadline
+
+
+def timeout(default=None):
+    """
+    Return the timeout for a call under the current deadline, or the default without one.
+    """
+    deadline = current()
+    return default if deadline is None else deadline.timeout(default)
+
+
+def check():
+    """
+    Raise DeadlineExceeded if the current deadline has run out.
+    """
+    deadline = current()
+    if deadline is not None:
+        deadline.check()
+
+
+def bind(function):
+    """
+    Wrap a function so that it runs under this thread's current deadline on any thread, for
+    work handed to a thread pool.
+    """
+    deadline = current()
+    if deadline is None:
+        return function
+
+    def bound(*args, **kwargs):
+        with activate(deadline):
+            return function(*args, **kwargs)
+    return bound
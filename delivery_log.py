@@ -0,0 +1,62 @@
+import json
+import os
+import threading
+import time
+
+
+class DeliveryLog:
+    """
+    Records the outcome of every book delivery, whatever channel it went through.
+
+    Entries are kept in memory for the current run and appended as JSON lines to a log file.
+    """
+
+    LOG_FILE = 'Logs/deliveries.jsonl'
+    SENT = 'sent'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+    RETRYING = 'retrying'
+
+    def __init__(self, path=LOG_FILE):
+        """
+        Initializes the DeliveryLog object.
+        :param path: The JSON lines file entries are appended to.
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self.entries = []
+
+    def record(self, book, recipient, channel, status, detail=None):
+        """
+        Record a delivery attempt.
+        :param book: The file name or title of the book.
+        :param recipient: The address the book was delivered to.
+        :param channel: How the book was delivered, e.g. 'email' or 'zlibrary-kindle'.
+        :param status: DeliveryLog.SENT, DeliveryLog.FAILED, DeliveryLog.SKIPPED or DeliveryLog.RETRYING.
+        :param detail: Extra information, such as the provider's status code or error.
+        :return: The recorded entry.
+        """
+        entry = {
+            'book': book,
+            'recipient': recipient,
+            'channel': channel,
+            'status': status,
+            'detail': detail,
+            'timestamp': time.time(),
+        }
+        with self._lock:
+            self.entries.append(entry)
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+            with open(self._path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        return entry
+
+    def summary(self):
+        """
+        Return the number of deliveries per status in this run.
+        """
+        with self._lock:
+            counts = {}
+            for entry in self.entries:
+                counts[entry['status']] = counts.get(entry['status'], 0) + 1
+            return counts
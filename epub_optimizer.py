@@ -0,0 +1,117 @@
+import io
+import os
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from icecream import ic
+
+from metrics import metrics
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, without it only the zip container is recompressed.
+    Image = None
+
+
+class EpubOptimizer:
+    """
+    Shrinks EPUBs before they are delivered.
+
+    Image-heavy books make large EPUBs, which are slow to upload once base64-encoded into an
+    email and often exceed the Kindle email size limit. The optimizer rewrites the zip container
+    at the highest compression level and, if Pillow is installed, downsamples images larger than
+    the target device resolution and re-encodes oversized ones. Images are processed in parallel.
+    File names are kept, so the book's manifest and references stay valid, and every entry keeps
+    its original bytes unless the rewritten ones are smaller.
+    """
+
+    TARGET_SIZE = (1264, 1680)
+    JPEG_QUALITY = 80
+    MIN_IMAGE_BYTES = 64 * 1024
+    IMAGE_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG'}
+
+    def __init__(self, target_size=TARGET_SIZE, jpeg_quality=JPEG_QUALITY, workers=None):
+        """
+        Initializes the EpubOptimizer object.
+        :param target_size: The (width, height) in pixels images are downsampled to fit in.
+        :param jpeg_quality: The quality JPEG images are re-encoded with.
+        :param workers: The number of images processed in parallel, by default one per CPU.
+        """
+        self.target_size = target_size
+        self.jpeg_quality = jpeg_quality
+        self.workers = workers or os.cpu_count() or 1
+        if Image is None:
+            ic("Pillow is not installed, EPUB images will not be resized.")
+
+    def _optimize_image(self, name, data):
+        """
+        Return the downsampled or re-encoded image, or the original bytes if that is not smaller.
+        """
+        image_format = self.IMAGE_FORMATS.get(os.path.splitext(name)[1].lower())
+        if Image is None or image_format is None:
+            return data
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                oversized = image.width > self.target_size[0] or image.height > self.target_size[1]
+                if not oversized and len(data) < self.MIN_IMAGE_BYTES:
+                    return data
+                image.load()
+                if oversized:
+                    image.thumbnail(self.target_size, Image.LANCZOS)
+                output = io.BytesIO()
+                if image_format == 'JPEG':
+                    if image.mode not in ('RGB', 'L'):
+                        image = image.convert('RGB')
+                    image.save(output, 'JPEG', quality=self.jpeg_quality, optimize=True)
+                else:
+                    image.save(output, 'PNG', optimize=True)
+        except (OSError, ValueError) as e:
+            ic(f"Could not optimize {name}: {e}")
+            return data
+        optimized = output.getvalue()
+        return optimized if len(optimized) < len(data) else data
+
+    def optimize(self, file_path):
+        """
+        Optimize an EPUB in place. The file is only replaced if the result is smaller.
+        :param file_path: The path of the EPUB.
+        :return: A dictionary with the original size, the new size and the bytes saved, or None
+            if the file is not an EPUB or could not be read.
+        """
+        if not file_path.endswith('.epub'):
+            return None
+        original_size = os.path.getsize(file_path)
+        try:
+            with metrics.timer('epub_optimize'):
+                with zipfile.ZipFile(file_path) as epub:
+                    entries = [(info, epub.read(info)) for info in epub.infolist()]
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    contents = list(executor.map(lambda entry: self._optimize_image(entry[0].filename, entry[1]), entries))
+
+                tmp_path = os.path.join(os.path.dirname(file_path), f".{uuid.uuid4().hex}.tmp")
+                with zipfile.ZipFile(tmp_path, 'w') as epub:
+                    # The mimetype entry has to come first and be stored uncompressed.
+                    for (info, _), data in sorted(zip(entries, contents), key=lambda item: item[0][0].filename != 'mimetype'):
+                        entry = zipfile.ZipInfo(info.filename, info.date_time)
+                        entry.external_attr = info.external_attr
+                        if info.filename == 'mimetype':
+                            entry.compress_type = zipfile.ZIP_STORED
+                            epub.writestr(entry, data)
+                        else:
+                            entry.compress_type = zipfile.ZIP_DEFLATED
+                            epub.writestr(entry, data, compresslevel=9)
+        except (zipfile.BadZipFile, OSError) as e:
+            ic(f"Could not optimize {file_path}: {e}")
+            return None
+
+        size = os.path.getsize(tmp_path)
+        if size < original_size:
+            os.replace(tmp_path, file_path)
+        else:
+            os.remove(tmp_path)
+            size = original_size
+        saved = original_size - size
+        metrics.inc('epub_bytes_saved_total', saved)
+        ic(f"Optimized {os.path.basename(file_path)}: {original_size} -> {size} bytes ({saved} saved)")
+        return {'original_size': original_size, 'size': size, 'saved': saved}
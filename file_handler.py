@@ -1,8 +1,33 @@
 import subprocess
 import os
 import os
+import shutil
 import subprocess
+import uuid
 from icecream import ic
+from metrics import metrics
+import deadline
+
+def _ebook_convert(file_path, output_path, format):
+    # Run calibre without a shell, so that the converter itself is killed when it runs out of time
+    try:
+        with metrics.timer('ebook_convert', format=format):
+            result = subprocess.run(['ebook-convert', file_path, output_path], timeout=deadline.timeout())
+    except FileNotFoundError:
+        ic('ebook-convert was not found, is calibre installed?')
+        return False
+    except subprocess.TimeoutExpired:
+        ic(f'Converting {file_path} timed out')
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        deadline.check()
+        return False
+    if result.returncode != 0 or not os.path.exists(output_path):
+        ic(f'Converting {file_path} failed with exit code {result.returncode}')
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return False
+    return True
 
 def convert_to_epub(file_path, directory):
     # Check if the file is a .mobi file
@@ -11,11 +36,10 @@ def convert_to_epub(file_path, directory):
         # Get the file name without extension
         file_name = os.path.splitext(os.path.basename(file_path))[0]
 
-        # Construct the command to convert .mobi to .epub
-        command = f'ebook-convert "{file_path}" "{os.path.join(directory, file_name)}.epub"'
-
-        # Execute the command using subprocess
-        subprocess.run(command, shell=True)
+        # Convert .mobi to .epub, within the time left for the job
+        output_path = f"{os.path.join(directory, file_name)}.epub"
+        if not _ebook_convert(file_path, output_path, 'mobi'):
+            return False
         ic(f'Converted {file_path} to {file_name}.epub')
         os.remove(file_path)
         return True
@@ -23,11 +47,10 @@ def convert_to_epub(file_path, directory):
     elif file_path.endswith('.azw3'):
         file_name = os.path.splitext(os.path.basename(file_path))[0]
 
-        # Construct the command to convert .mobi to .epub
-        command = f'ebook-convert "{file_path}" "{os.path.join(directory, file_name)}.epub"'
-
-        # Execute the command using subprocess
-        subprocess.run(command, shell=True)
+        # Convert .azw3 to .epub, within the time left for the job
+        output_path = f"{os.path.join(directory, file_name)}.epub"
+        if not _ebook_convert(file_path, output_path, 'azw3'):
+            return False
         ic(f'Converted {file_path} to {file_name}.epub')
         os.remove(file_path)
         return True
@@ -56,6 +79,15 @@ def move_file(file_path, new_directory):
     # Construct the new file path
     new_file_path = os.path.join(new_directory, file_name)
 
-    # Move the file
-    os.rename(file_path, new_file_path)
-    ic(f'Moved {file_path} to {new_file_path}')
\ No newline at end of file
+    # Move the file with an atomic rename, so the destination never shows a half-written file.
+    # Across filesystems, copy next to the destination first and rename from there.
+    os.makedirs(new_directory, exist_ok=True)
+    try:
+        os.replace(file_path, new_file_path)
+    except OSError:
+        tmp_path = os.path.join(new_directory, f'.{file_name}.{uuid.uuid4().hex}.tmp')
+        shutil.copy2(file_path, tmp_path)
+        os.replace(tmp_path, new_file_path)
+        os.remove(file_path)
+    ic(f'Moved {file_path} to {new_file_path}')
+    return new_file_path
\ No newline at end of file
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import struct
+import zipfile
+
+from metrics import metrics
+
+
+MIN_BOOK_SIZE = 2 * 1024
+MAX_BOOK_SIZE = 500 * 1024 * 1024
+EPUB_MIMETYPE = b'application/epub+zip'
+ZIP_MAGIC = b'PK\x03\x04'
+PDF_MAGIC = b'%PDF-'
+PALMDB_HEADER_SIZE = 78
+PALMDB_TYPES = (b'BOOKMOBI', b'TEXtREAd')
+PALMDB_EXTENSIONS = ('.mobi', '.azw3', '.azw', '.prc', '.pdb')
+HTML_PREFIXES = (b'<!doctype', b'<html', b'<head', b'<body', b'<?xml', b'<script', b'<meta')
+MARKUP_EXTENSIONS = ('.fb2', '.xml', '.html', '.htm', '.txt', '.rtf')
+CHUNK_SIZE = 1024 * 1024
+
+
+def _check_epub(path):
+    # Opening the archive reads the central directory at the end of the file, so a truncated
+    # transfer fails here without inflating anything
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = set(archive.namelist())
+            if 'mimetype' not in names:
+                return 'EPUB has no mimetype entry'
+            if archive.read('mimetype').strip() != EPUB_MIMETYPE:
+                return 'EPUB mimetype entry is not application/epub+zip'
+            if 'META-INF/container.xml' not in names:
+                return 'EPUB has no META-INF/container.xml'
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, KeyError, OSError) as e:
+        return f'not a readable ZIP archive ({e})'
+    return None
+
+
+def _check_palmdb(path, size):
+    with open(path, 'rb') as f:
+        header = f.read(PALMDB_HEADER_SIZE)
+        if len(header) < PALMDB_HEADER_SIZE or header[60:68] not in PALMDB_TYPES:
+            return 'no MOBI/PalmDB header'
+        records = struct.unpack('>H', header[76:78])[0]
+        entries = f.read(records * 8)
+    if records == 0 or len(entries) < records * 8:
+        return 'PalmDB record list is truncated'
+    offsets = [struct.unpack('>I', entries[index * 8:index * 8 + 4])[0] for index in range(records)]
+    if any(later < earlier for earlier, later in zip(offsets, offsets[1:])) or offsets[-1] >= size:
+        return 'PalmDB records point past the end of the file'
+    return None
+
+
+def _check_pdf(path, size):
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - 1024))
+        if b'%%EOF' not in f.read():
+            return 'PDF has no end-of-file marker'
+    return None
+
+
+def file_md5(path):
+    """
+    Return the MD5 of a file.
+    """
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def validate_book(path, expected_md5=None):
+    """
+    Check cheaply that a downloaded file is the book it claims to be.
+
+    Mirrors sometimes serve an HTML error page, a truncated transfer or another format under a
+    book's name. The file is checked for a sane size, for markup where a book was expected, and
+    for the structure of its format, chosen by its extension: an EPUB must be a ZIP archive with
+    a readable central directory, an application/epub+zip mimetype entry and a container, and a
+    MOBI or AZW3 must have a PalmDB header whose records lie within the file. Only the header and
+    the end of the file are read, unless an MD5 is given.
+
+    :param path: The path of the downloaded file.
+    :param expected_md5: The MD5 of the book from the Libgen listing, if known.
+    :return: None if the file looks valid, otherwise the reason it was rejected.
+    """
+    reason = _find_problem(path, expected_md5)
+    metrics.inc('file_validation_total', outcome='valid' if reason is None else 'rejected')
+    return reason
+
+
+def _find_problem(path, expected_md5):
+    try:
+        size = os.path.getsize(path)
+        if size < MIN_BOOK_SIZE:
+            return f'too small to be a book ({size} bytes)'
+        if size > MAX_BOOK_SIZE:
+            return f'too large to be a book ({size} bytes)'
+        with open(path, 'rb') as f:
+            head = f.read(512)
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in MARKUP_EXTENSIONS and head.lstrip().lower().startswith(HTML_PREFIXES):
+            return 'an HTML or XML page instead of a book'
+
+        if extension == '.epub':
+            reason = _check_epub(path) if head.startswith(ZIP_MAGIC) else 'not a ZIP archive'
+        elif extension in PALMDB_EXTENSIONS:
+            reason = _check_palmdb(path, size)
+        elif extension == '.pdf':
+            reason = _check_pdf(path, size) if head.startswith(PDF_MAGIC) else 'no PDF header'
+        else:
+            reason = None
+        if reason is None and expected_md5 and file_md5(path) != expected_md5.lower():
+            reason = 'MD5 does not match the listing'
+        return reason
+    except OSError as e:
+        return f'could not be read ({e})'
@@ -0,0 +1,310 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+import requests
+from icecream import ic
+
+from rate_limiter import rate_limiter
+import deadline
+
+
+MD5_PATTERN = re.compile(r'\b([0-9a-fA-F]{32})\b')
+
+CONTENT_TYPE_EXTENSIONS = {
+    'application/epub+zip': '.epub',
+    'application/x-mobipocket-ebook': '.mobi',
+    'application/vnd.amazon.ebook': '.azw3',
+    'application/pdf': '.pdf',
+}
+
+
+def md5_from_url(url):
+    """
+    Extract the MD5 a Libgen mirror URL refers to, if it contains one.
+    :param url: The mirror URL.
+    :return: The lowercase MD5, or None.
+    """
+    if not isinstance(url, str):
+        return None
+    match = MD5_PATTERN.search(url)
+    return match.group(1).lower() if match else None
+
+
+class _Attempt:
+    """
+    The state of a single download from one mirror.
+    """
+
+    def __init__(self, url, part_path, settled):
+        self.url = url
+        self.part_path = part_path
+        self.settled = settled
+        self.cancelled = threading.Event()
+        self.started = time.time()
+        self.first_byte = None
+        self.bytes = 0
+        self.filename = None
+        self.done = False
+        self.error = None
+        self.finished = None
+        self.hedged = False
+        self.thread = None
+
+
+class HedgedDownloader:
+    """
+    Downloads a file from several mirrors, starting a backup download when the current one
+    stalls and keeping whichever complete, verified copy finishes first.
+
+    The download starts on the first (best) URL. When no bytes arrive within the stall deadline,
+    or the throughput stays below the minimum, the next URL is started in parallel. As soon as one
+    attempt finishes and passes verification, the others are cancelled and their partial files
+    removed.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, session=None, stall_deadline=10, min_throughput=50 * 1024, check_interval=0.5, timeout=30):
+        """
+        Initializes the HedgedDownloader object.
+        :param session: The requests session to download with.
+        :param stall_deadline: Seconds an attempt may go without a first byte, or below the
+            minimum throughput, before a backup download is started.
+        :param min_throughput: The throughput in bytes per second below which an attempt is hedged.
+        :param check_interval: Seconds between progress checks.
+        :param timeout: The connect and read timeout of each request.
+        """
+        self._session = session if session is not None else requests.Session()
+        self.stall_deadline = stall_deadline
+        self.min_throughput = min_throughput
+        self.check_interval = check_interval
+        self.timeout = timeout
+
+    @staticmethod
+    def _filename_from_response(response, url):
+        disposition = response.headers.get('Content-Disposition', '')
+        match = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", disposition, re.IGNORECASE)
+        if match is None:
+            match = re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE)
+        if match is not None:
+            return os.path.basename(unquote(match.group(1).strip().strip('"')))
+
+        name = os.path.basename(unquote(urlparse(url).path))
+        extension = CONTENT_TYPE_EXTENSIONS.get(response.headers.get('Content-Type', '').split(';')[0].strip())
+        if extension and not name.endswith(extension):
+            name = os.path.splitext(name)[0] + extension
+        return name or 'download'
+
+    def _run(self, attempt, expected_md5):
+        """
+        Download a single URL into the attempt's partial file, verifying length and MD5.
+        """
+        digest = hashlib.md5()
+        try:
+            with rate_limiter.request('GET', attempt.url, session=self._session, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                attempt.filename = self._filename_from_response(response, attempt.url)
+                expected_length = int(response.headers.get('Content-Length') or 0)
+                with open(attempt.part_path, 'wb') as f:
+                    for chunk in response.iter_content(self.CHUNK_SIZE):
+                        if attempt.cancelled.is_set():
+                            return
+                        if attempt.first_byte is None:
+                            attempt.first_byte = time.time()
+                        f.write(chunk)
+                        digest.update(chunk)
+                        attempt.bytes += len(chunk)
+            if expected_length and attempt.bytes != expected_length:
+                raise IOError(f"Truncated download: got {attempt.bytes} of {expected_length} bytes")
+            if expected_md5 and digest.hexdigest() != expected_md5.lower():
+                raise IOError("MD5 mismatch")
+            attempt.done = True
+        except (requests.RequestException, OSError) as e:
+            if not attempt.cancelled.is_set():
+                attempt.error = e
+                ic(f"Download from {attempt.url} failed: {e}")
+        finally:
+            attempt.finished = time.time()
+            if not attempt.done:
+                try:
+                    os.remove(attempt.part_path)
+                except OSError:
+                    pass
+            attempt.settled.set()
+
+    def _is_lagging(self, attempt, now):
+        if attempt.first_byte is None:
+            return now - attempt.started > self.stall_deadline
+        streaming_for = now - attempt.first_byte
+        return streaming_for > self.stall_deadline and attempt.bytes / streaming_for < self.min_throughput
+
+    def _start(self, url, directory, expected_md5, settled):
+        attempt = _Attempt(url, os.path.join(directory, f".hedge-{uuid.uuid4().hex}.part"), settled)
+        attempt.thread = threading.Thread(target=self._run, args=(attempt, expected_md5), daemon=True)
+        attempt.thread.start()
+        return attempt
+
+    def download(self, urls, directory, expected_md5=None):
+        """
+        Download a file, hedging across the given URLs.
+        :param urls: The download URLs, best first.
+        :param directory: The directory to save the file in.
+        :param expected_md5: The MD5 the file must have, if known.
+        :return: A dictionary describing the winning download and the URLs that failed, or None
+            if every URL failed.
+        :raises DeadlineExceeded: If the current deadline runs out first; every attempt is
+            cancelled.
+        """
+        pending = list(urls)
+        # Set by every attempt when it finishes, so a winner is noticed without waiting out the
+        # check interval
+        settled = threading.Event()
+        attempts = [self._start(pending.pop(0), directory, expected_md5, settled)] if pending else []
+        winner = None
+
+        while attempts:
+            try:
+                deadline.check()
+            except deadline.DeadlineExceeded:
+                for attempt in attempts:
+                    attempt.cancelled.set()
+                raise
+            winner = next((attempt for attempt in attempts if attempt.done and attempt.finished is not None), None)
+            if winner is not None:
+                break
+            active = [attempt for attempt in attempts if attempt.finished is None]
+            if not active and not pending:
+                break
+
+            now = time.time()
+            lagging = [attempt for attempt in active if not attempt.hedged and self._is_lagging(attempt, now)]
+            if pending and (not active or lagging):
+                for attempt in lagging:
+                    attempt.hedged = True
+                ic(f"Starting a backup download from {pending[0]}")
+                attempts.append(self._start(pending.pop(0), directory, expected_md5, settled))
+            # Attempts finishing after the wait are seen at the top of the next iteration
+            settled.wait(self.check_interval)
+            settled.clear()
+
+        # The losers are not waited for, as a read blocked on a slow mirror only returns at its
+        # timeout. Their threads stop at the next chunk and remove their partial files.
+        failed = [attempt.url for attempt in attempts if attempt.error is not None]
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancelled.set()
+        if winner is None:
+            return None
+
+        path = os.path.join(directory, winner.filename)
+        os.replace(winner.part_path, path)
+        ttfb = (winner.first_byte or winner.finished) - winner.started
+        return {
+            'path': path,
+            'url': winner.url,
+            'ttfb': ttfb,
+            'size': winner.bytes,
+            'duration': winner.finished - winner.started,
+            'failed': failed,
+        }
+
+    def _fetch_range(self, url, part_path, start, end):
+        headers = {'Range': f'bytes={start}-{end}'}
+        with rate_limiter.request('GET', url, session=self._session, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code != 206:
+                raise IOError(f"{url} ignored the Range request")
+            written = 0
+            with open(part_path, 'r+b') as f:
+                f.seek(start)
+                for chunk in response.iter_content(self.CHUNK_SIZE):
+                    deadline.check()
+                    f.write(chunk)
+                    written += len(chunk)
+        if written != end - start + 1:
+            raise IOError(f"Short range from {url}: got {written} of {end - start + 1} bytes")
+
+    def download_segmented(self, urls, directory, expected_md5):
+        """
+        Download a file in byte ranges split across mirrors that serve the same MD5.
+
+        Falls back to a hedged download when the first mirror does not advertise range support.
+        :param urls: The download URLs, best first.
+        :param directory: The directory to save the file in.
+        :param expected_md5: The MD5 every mirror serves; required to verify the reassembled file.
+        :return: A dictionary describing the download, or None if it failed.
+        """
+        urls = list(urls)
+        if not urls or not expected_md5:
+            return self.download(urls, directory, expected_md5)
+
+        start_time = time.time()
+        try:
+            head = rate_limiter.request('HEAD', urls[0], session=self._session, allow_redirects=True, timeout=self.timeout)
+            head.raise_for_status()
+        except requests.RequestException as e:
+            ic(f"Could not probe {urls[0]} for range support: {e}")
+            return self.download(urls[1:], directory, expected_md5)
+        size = int(head.headers.get('Content-Length') or 0)
+        if not size or head.headers.get('Accept-Ranges', '').lower() != 'bytes':
+            return self.download(urls, directory, expected_md5)
+        ttfb = time.time() - start_time
+
+        part_path = os.path.join(directory, f".segmented-{uuid.uuid4().hex}.part")
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+
+        segment_size = -(-size // len(urls))
+        segments = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+        failed = []
+        try:
+            fetch_range = deadline.bind(self._fetch_range)
+            with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+                futures = {pool.submit(fetch_range, url, part_path, *segment): (url, segment)
+                           for url, segment in zip(urls, segments)}
+                retry = []
+                for future, (url, segment) in futures.items():
+                    try:
+                        future.result()
+                    except (requests.RequestException, OSError) as e:
+                        ic(f"Segment {segment} from {url} failed: {e}")
+                        failed.append(url)
+                        retry.append(segment)
+
+            for segment in retry:
+                for url in (url for url in urls if url not in failed):
+                    try:
+                        self._fetch_range(url, part_path, *segment)
+                        break
+                    except (requests.RequestException, OSError) as e:
+                        ic(f"Retrying segment {segment} from {url} failed: {e}")
+                        failed.append(url)
+                else:
+                    raise IOError(f"No mirror could serve bytes {segment[0]}-{segment[1]}")
+
+            digest = hashlib.md5()
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            if digest.hexdigest() != expected_md5.lower():
+                raise IOError("MD5 mismatch after reassembling segments")
+        except OSError as e:
+            ic(f"Segmented download failed: {e}")
+            os.remove(part_path)
+            return self.download([url for url in urls if url not in failed], directory, expected_md5)
+
+        path = os.path.join(directory, self._filename_from_response(head, urls[0]))
+        os.replace(part_path, path)
+        return {
+            'path': path,
+            'url': urls[0],
+            'ttfb': ttfb,
+            'size': size,
+            'duration': time.time() - start_time,
+            'failed': failed,
+        }
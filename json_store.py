@@ -0,0 +1,51 @@
+import json
+import os
+import uuid
+
+from icecream import ic
+
+
+def write_atomically(path, text):
+    """
+    Replace a text file atomically. The text is written to a uniquely named temporary file next
+    to it first, so concurrent writers never share a temporary file and readers never see a
+    half-written one.
+    :param path: The file to write.
+    :param text: Its new content.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_json(path, description):
+    """
+    Load a JSON file written by save_json.
+    :param path: The file to load.
+    :param description: What the file holds, for the message logged when it cannot be read.
+    :return: The data, or None if the file does not exist or cannot be read.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        ic(f"Could not read the {description} {path}: {e}")
+        return None
+
+
+def save_json(path, data):
+    """
+    Persist data as JSON, replacing the previous file atomically.
+    :param path: The file to write.
+    :param data: The data to serialize.
+    """
+    write_atomically(path, json.dumps(data, indent=2))
@@ -0,0 +1,100 @@
+import html
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+from rate_limiter import rate_limiter
+
+
+GET_ANCHOR = re.compile(r'<[aA]\s[^>]*?(?i:href)\s*=\s*["\']([^"\'>]*)["\'][^>]*>\s*GET\s*</[aA]>')
+
+
+def parse_download_links(page):
+    """
+    Find the GET download link of a mirror page.
+
+    The anchor is found with a targeted scan of the page. Pages the scan does not understand
+    fall back to BeautifulSoup, parsing only the anchor tags.
+
+    :param page: The HTML of the mirror page.
+    :return: A dictionary with the 'GET' link, or an empty dictionary if there is none.
+    """
+    match = GET_ANCHOR.search(page)
+    if match:
+        return {'GET': html.unescape(match.group(1))}
+    soup = BeautifulSoup(page, "html.parser", parse_only=SoupStrainer("a"))
+    link = soup.find("a", string="GET", href=True)
+    return {'GET': link["href"]} if link is not None else {}
+
+
+class LinkResolver:
+    """
+    Resolves mirror pages to their GET download links.
+
+    Pages are fetched over a pooled session, so connections to a mirror are reused, and the
+    resolved links are cached per mirror URL for a short time, so retries and other scrapers
+    sharing the resolver do not fetch the same page again.
+    """
+
+    TTL = 10 * 60
+    TIMEOUT = 20
+    POOL_SIZE = 16
+
+    def __init__(self, session=None, ttl=TTL, timeout=TIMEOUT):
+        """
+        Initializes the LinkResolver object.
+        :param session: The requests session to fetch pages with, if any.
+        :param ttl: Seconds a resolved link is served from the cache.
+        :param timeout: The connect and read timeout of each page request.
+        """
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.POOL_SIZE, pool_maxsize=self.POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self._session = session
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def resolve(self, url):
+        """
+        Return the download links of a mirror page, from the cache if it was resolved recently.
+        :param url: The URL of the mirror page.
+        :return: A dictionary with the 'GET' link, or an empty dictionary if the page has none.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(url)
+            if cached is not None and cached[0] > now:
+                metrics.inc('link_cache_total', outcome='hit')
+                return dict(cached[1])
+        metrics.inc('link_cache_total', outcome='miss')
+
+        with metrics.timer('resolve_links', mirror=urlparse(url).netloc.lower()):
+            page = rate_limiter.request('GET', url, session=self._session, timeout=self.timeout)
+            links = parse_download_links(page.text)
+        if links:
+            with self._lock:
+                self._cache[url] = (time.time() + self.ttl, links)
+                self._evict(now)
+        return dict(links)
+
+    def invalidate(self, url):
+        """
+        Forget the cached links of a mirror page, for example after its GET link failed.
+        """
+        with self._lock:
+            self._cache.pop(url, None)
+
+    def _evict(self, now):
+        expired = [url for url, (expires, _) in self._cache.items() if expires <= now]
+        for url in expired:
+            del self._cache[url]
@@ -1,9 +1,14 @@
 import os
 import base64
+import math
 from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Attachment, FileContent, FileType, FileName, Disposition
+from sendgrid.helpers.mail import Mail, To, Attachment, FileContent, FileType, FileName, Disposition
 from dotenv import load_dotenv
 from icecream import ic
+from rate_limiter import rate_limiter, api_key_bucket
+from metrics import metrics
+import deadline
+from deadline import DeadlineExceeded
 
 class MailService:
     """
@@ -11,19 +16,46 @@ class MailService:
 
     Attributes:
         SENDGRID_API_KEY (str): The API key for SendGrid.
+        MAX_MESSAGE_SIZE (int): The largest message SendGrid accepts, attachments included, in bytes.
+        MAX_PERSONALIZATIONS (int): The most recipients SendGrid accepts in a single request.
+        SEND_TIMEOUT (int): The timeout of a send request in seconds, shortened to fit the current deadline.
 
     Methods:
-        __init__(): Initializes the MailService object and loads the SendGrid API key from environment variables.
+        __init__(host): Initializes the MailService object and loads the SendGrid API key from environment variables.
+        attachment_fits(file_path): Checks whether a file fits in a message once base64-encoded.
         send_email_with_attachment(from_email, to_email, subject, html_content, file_path, file_name): Sends an email with an attachment.
+        send_email_to_recipients(from_email, recipients, subject, html_content, file_path, file_name): Sends an email with an attachment to several recipients.
 
     """
 
-    def __init__(self):
+    MAX_MESSAGE_SIZE = 30 * 1024 * 1024
+    MESSAGE_OVERHEAD = 64 * 1024
+    MAX_PERSONALIZATIONS = 1000
+    SEND_TIMEOUT = 60
+
+    def __init__(self, host=None):
         """
         Initializes the MailService object and loads the SendGrid API key from environment variables.
+
+        Args:
+            host (str, optional): The SendGrid API host. Defaults to SENDGRID_HOST or the public API.
         """
         load_dotenv()
         self.SENDGRID_API_KEY = os.getenv('SENDGRID_API_KEY')
+        self.host = host or os.getenv('SENDGRID_HOST', 'https://api.sendgrid.com')
+
+    def attachment_fits(self, file_path):
+        """
+        Checks whether a file still fits in a message once base64-encoded.
+
+        Args:
+            file_path (str): The file path of the attachment.
+
+        Returns:
+            bool: True if the encoded file and the rest of the message fit within MAX_MESSAGE_SIZE.
+        """
+        encoded_size = 4 * math.ceil(os.path.getsize(file_path) / 3)
+        return encoded_size + self.MESSAGE_OVERHEAD <= self.MAX_MESSAGE_SIZE
 
     def send_email_with_attachment(self, from_email, to_email, subject, html_content, file_path, file_name):
         """
@@ -38,18 +70,52 @@ class MailService:
             file_name (str): The name of the attachment file.
 
         Returns:
-            None
+            int: The status code returned by SendGrid, or None if no response was received.
+
+        """
+        statuses = self.send_email_to_recipients(from_email, [to_email], subject, html_content, file_path, file_name)
+        return statuses[to_email]
+
+    def send_email_to_recipients(self, from_email, recipients, subject, html_content, file_path, file_name):
+        """
+        Sends an email with an attachment to several recipients.
+
+        The attachment is read and base64-encoded once. Every recipient gets a personalization of
+        their own, so they receive separate messages and do not see each other's addresses, and up
+        to MAX_PERSONALIZATIONS recipients share a single API request.
+
+        Args:
+            from_email (str): The email address of the sender.
+            recipients (list): The email addresses of the recipients. Duplicates are sent to once.
+            subject (str): The subject of the email.
+            html_content (str): The HTML content of the email.
+            file_path (str): The file path of the attachment.
+            file_name (str): The name of the attachment file.
+
+        Returns:
+            dict: The status code SendGrid returned for every recipient, or None for the
+                recipients whose request got no response.
 
         """
-        message = Mail(
-            from_email=from_email,
-            to_emails=to_email,
-            subject=subject,
-            html_content=html_content)
+        recipients = list(dict.fromkeys(recipients))
+        attachment = self._build_attachment(file_path, file_name)
+        statuses = {}
+        for start in range(0, len(recipients), self.MAX_PERSONALIZATIONS):
+            batch = recipients[start:start + self.MAX_PERSONALIZATIONS]
+            message = Mail(
+                from_email=from_email,
+                to_emails=[To(recipient) for recipient in batch],
+                subject=subject,
+                html_content=html_content,
+                is_multiple=True)
+            message.attachment = attachment
+            status_code = self._send(message, os.path.getsize(file_path))
+            statuses.update((recipient, status_code) for recipient in batch)
+        return statuses
 
+    def _build_attachment(self, file_path, file_name):
         with open(file_path, 'rb') as f:
             data = f.read()
-            f.close()
         encoded = base64.b64encode(data).decode()
 
         attachment = Attachment()
@@ -64,17 +130,28 @@ class MailService:
         else:
             # Default or other file types handling
             attachment.file_type = FileType('application/octet-stream')
-        
+
         attachment.file_name = FileName(file_name)
         attachment.disposition = Disposition('attachment')
-        message.attachment = attachment
+        return attachment
 
+    def _send(self, message, size):
         try:
-            sg = SendGridAPIClient(self.SENDGRID_API_KEY)
-            response = sg.send(message)
+            sg = SendGridAPIClient(self.SENDGRID_API_KEY, host=self.host)
+            sg.client.timeout = deadline.timeout(self.SEND_TIMEOUT)
+            with metrics.timer('sendgrid_send', source='sendgrid'):
+                response = rate_limiter.call('api.sendgrid.com', sg.send, message,
+                                             key=api_key_bucket('sendgrid', self.SENDGRID_API_KEY))
+            metrics.inc('bytes_sent_total', size, source='sendgrid')
             ic(response.status_code)
             ic(response.body)
             ic(response.headers)
+            return response.status_code
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             ic("Error sending email")
             ic(e)
+            # SendGrid raises an HTTPError carrying the status code for error responses, which
+            # tells a rejected message from one that failed to go out
+            return getattr(e, 'status_code', None)
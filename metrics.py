@@ -0,0 +1,183 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from json_store import write_atomically
+
+
+class _Histogram:
+    """
+    Cumulative latency histogram with fixed bucket bounds.
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimate a quantile by interpolating linearly inside the bucket it falls in.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.bounds, self.counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.bounds[-1]
+
+
+class Metrics:
+    """
+    In-process registry of counters and latency histograms, keyed by metric name and labels.
+
+    Recording a value is a dictionary lookup and an addition under a lock, so it is cheap enough
+    to leave on. Snapshots can be exported in the Prometheus text format or as JSON.
+    """
+
+    PREFIX = 'book_collector_'
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Initializes the Metrics object.
+        :param buckets: The upper bounds, in seconds, of the histogram buckets.
+        """
+        self._buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add to a counter.
+        :param name: The name of the counter.
+        :param value: The amount to add.
+        :param labels: The labels identifying the series.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Record a value in a histogram.
+        :param name: The name of the histogram.
+        :param value: The observed value.
+        :param labels: The labels identifying the series.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self._buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """
+        Time a pipeline stage, recording its latency and whether it raised.
+        :param stage: The name of the stage.
+        :param labels: Further labels, such as the source or mirror.
+        """
+        start_time = time.perf_counter()
+        outcome = 'error'
+        try:
+            yield
+            outcome = 'ok'
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start_time, stage=stage, **labels)
+            self.inc('stage_total', stage=stage, outcome=outcome, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """
+        Return every counter and histogram as plain data.
+        """
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in self._counters.items()]
+            histograms = [{
+                'name': name,
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'buckets': dict(zip([str(bound) for bound in self._buckets] + ['+Inf'], histogram.counts)),
+                'p50': histogram.quantile(0.5),
+                'p95': histogram.quantile(0.95),
+            } for (name, labels), histogram in self._histograms.items()]
+        return {'timestamp': time.time(), 'counters': counters, 'histograms': histograms}
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (f'{key}="{value}"'.replace('\n', ' ') for key, value in pairs)
+        return '{' + ','.join(escaped) + '}'
+
+    def to_prometheus(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            typed = set()
+            for (name, labels), value in counters:
+                metric = self.PREFIX + name
+                if metric not in typed:
+                    lines.append(f'# TYPE {metric} counter')
+                    typed.add(metric)
+                lines.append(f'{metric}{self._format_labels(labels)} {value}')
+            for (name, labels), histogram in histograms:
+                metric = self.PREFIX + name
+                if metric not in typed:
+                    lines.append(f'# TYPE {metric} histogram')
+                    typed.add(metric)
+                cumulative = 0
+                for bound, count in zip(list(self._buckets) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{self._format_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{metric}_sum{self._format_labels(labels)} {histogram.sum}')
+                lines.append(f'{metric}_count{self._format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Write the metrics to a Prometheus text file, e.g. for the node exporter textfile collector.
+        """
+        write_atomically(path, self.to_prometheus())
+
+    def write_json(self, path):
+        """
+        Write a JSON snapshot of the metrics.
+        """
+        write_atomically(path, json.dumps(self.snapshot(), indent=2))
+
+
+metrics = Metrics()
@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+from icecream import ic
+
+from json_store import load_json, write_atomically
+
+
+class MirrorHealthTracker:
+    """
+    Tracks how well each mirror host has been serving downloads and orders mirrors accordingly.
+
+    For every host it keeps the success rate, a moving average of the time to first byte and a
+    moving average of the download throughput. Hosts that fail several times in a row have their
+    circuit opened and are skipped until a cooldown expires, after which a single trial request
+    is let through again. The statistics are persisted as JSON so they survive across runs.
+    """
+
+    HEALTH_FILE = 'Logs/mirror_health.json'
+    FAILURE_THRESHOLD = 3
+    COOLDOWN = 15 * 60
+    SMOOTHING = 0.3
+    EXPECTED_BOOK_SIZE = 2 * 1024 * 1024
+    DEFAULT_TTFB = 2.0
+    DEFAULT_THROUGHPUT = 256 * 1024
+
+    def __init__(self, path=HEALTH_FILE):
+        """
+        Initializes the MirrorHealthTracker object.
+        :param path: The JSON file the statistics are loaded from and saved to.
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._hosts = self._load()
+
+    def _load(self):
+        return load_json(self._path, 'mirror health') or {}
+
+    def save(self):
+        """
+        Persist the statistics, replacing the previous file atomically. Scrapers sharing the
+        tracker save one at a time, so a newer snapshot is never replaced by an older one.
+        """
+        with self._save_lock:
+            with self._lock:
+                snapshot = json.dumps(self._hosts, indent=2)
+            write_atomically(self._path, snapshot)
+
+    @staticmethod
+    def host_of(url):
+        """
+        Return the host part of a mirror URL.
+        """
+        return urlparse(url).netloc.lower()
+
+    def _stats(self, host):
+        return self._hosts.setdefault(host, {
+            'successes': 0,
+            'failures': 0,
+            'consecutive_failures': 0,
+            'ttfb': None,
+            'throughput': None,
+            'open_until': 0,
+        })
+
+    def _smooth(self, previous, sample):
+        if previous is None:
+            return sample
+        return (1 - self.SMOOTHING) * previous + self.SMOOTHING * sample
+
+    def record_success(self, host, ttfb, size, duration):
+        """
+        Record a completed download from a host.
+        :param host: The mirror host.
+        :param ttfb: Seconds until the mirror first answered.
+        :param size: The number of bytes downloaded.
+        :param duration: Seconds the whole download took.
+        """
+        with self._lock:
+            stats = self._stats(host)
+            stats['successes'] += 1
+            stats['consecutive_failures'] = 0
+            stats['open_until'] = 0
+            stats['ttfb'] = self._smooth(stats['ttfb'], ttfb)
+            if size and duration > 0:
+                stats['throughput'] = self._smooth(stats['throughput'], size / duration)
+
+    def record_failure(self, host):
+        """
+        Record a failed download from a host, opening its circuit after repeated failures.
+        :param host: The mirror host.
+        """
+        with self._lock:
+            stats = self._stats(host)
+            stats['failures'] += 1
+            stats['consecutive_failures'] += 1
+            if stats['consecutive_failures'] >= self.FAILURE_THRESHOLD:
+                stats['open_until'] = time.time() + self.COOLDOWN
+                ic(f"Mirror {host} failed {stats['consecutive_failures']} times in a row, skipping it for a while.")
+
+    def is_available(self, host):
+        """
+        Return False while the circuit of a host is open.
+        """
+        with self._lock:
+            stats = self._hosts.get(host)
+            return stats is None or stats['open_until'] <= time.time()
+
+    def expected_time(self, host, size=EXPECTED_BOOK_SIZE):
+        """
+        Estimate how long a download of the given size from a host will take, accounting for
+        the chance that it fails and has to be retried elsewhere.
+        """
+        with self._lock:
+            stats = self._hosts.get(host)
+            if stats is None:
+                return self.DEFAULT_TTFB + size / self.DEFAULT_THROUGHPUT
+            ttfb = stats['ttfb'] if stats['ttfb'] is not None else self.DEFAULT_TTFB
+            throughput = stats['throughput'] or self.DEFAULT_THROUGHPUT
+            success_rate = (stats['successes'] + 1) / (stats['successes'] + stats['failures'] + 2)
+            return (ttfb + size / throughput) / success_rate
+
+    def rank(self, links, size=EXPECTED_BOOK_SIZE):
+        """
+        Order mirrors by expected completion time, leaving out hosts whose circuit is open.
+        :param links: A mapping of mirror names to mirror URLs.
+        :param size: The expected size of the download in bytes.
+        :return: The mirror names, fastest first.
+        """
+        candidates = [(name, self.host_of(url)) for name, url in links.items() if isinstance(url, str) and url]
+        available = [(name, host) for name, host in candidates if self.is_available(host)]
+        skipped = len(candidates) - len(available)
+        if skipped:
+            ic(f"Skipping {skipped} mirror(s) with an open circuit.")
+        return [name for name, host in sorted(available, key=lambda item: self.expected_time(item[1], size))]
+
+    def snapshot(self):
+        """
+        Return a copy of the statistics for every host.
+        """
+        with self._lock:
+            return {host: dict(stats) for host, stats in self._hosts.items()}
@@ -0,0 +1,165 @@
+import csv
+import os
+import re
+import threading
+import time
+
+from icecream import ic
+
+from json_store import load_json, save_json
+
+
+class NotFoundStore:
+    """
+    Remembers books that could not be found so that repeated requests are skipped instantly.
+
+    Every miss is cached for a negative-cache TTL, during which the book is not searched again.
+    Independently, each miss is scheduled for a cheap background re-check with exponential
+    backoff, so books that show up later are still picked up. Books that were found but could
+    not be downloaded, for instance because their mirrors were down, are only cached and
+    re-checked on a much shorter schedule. The entries are persisted as JSON
+    and every miss is also appended to a human-readable CSV log.
+    """
+
+    STORE_FILE = 'Logs/not_found_books.json'
+    LOG_FILE = 'Logs/not_found_books.csv'
+    NEGATIVE_TTL = 24 * 60 * 60
+    RETRY_BASE = 6 * 60 * 60
+    RETRY_MAX = 7 * 24 * 60 * 60
+    TRANSIENT_TTL = 30 * 60
+
+    def __init__(self, path=STORE_FILE, log_path=LOG_FILE, ttl=NEGATIVE_TTL):
+        """
+        Initializes the NotFoundStore object.
+        :param path: The JSON file the entries are loaded from and saved to.
+        :param log_path: The CSV file every miss is appended to.
+        :param ttl: Seconds a miss is served from the cache before the book is searched again.
+        """
+        self._path = path
+        self._log_path = log_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        return load_json(self._path, 'not-found store') or {}
+
+    def _save(self):
+        save_json(self._path, self._entries)
+
+    def _append_log(self, title, now):
+        os.makedirs(os.path.dirname(self._log_path) or '.', exist_ok=True)
+        new_file = not os.path.exists(self._log_path)
+        with open(self._log_path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(['Book Name', 'Timestamp'])
+            writer.writerow([title, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))])
+
+    @staticmethod
+    def key(title):
+        """
+        Return the cache key of a title.
+        """
+        return re.sub(r'\s+', ' ', str(title)).strip().lower()
+
+    def is_known_miss(self, title):
+        """
+        Return True if the book was not found within the negative-cache TTL.
+        """
+        with self._lock:
+            entry = self._entries.get(self.key(title))
+            return entry is not None and entry['expires'] > time.time()
+
+    def record_miss(self, title, transient=False):
+        """
+        Record that a book could not be found and schedule its next re-check.
+        :param title: The title as it was requested.
+        :param transient: The book was found but could not be downloaded, so it is only cached
+            for TRANSIENT_TTL and re-checked with a backoff starting at TRANSIENT_TTL.
+        """
+        now = time.time()
+        ttl, retry_base = (self.TRANSIENT_TTL, self.TRANSIENT_TTL) if transient else (self.ttl, self.RETRY_BASE)
+        with self._lock:
+            entry = self._entries.setdefault(self.key(title), {'title': title, 'attempts': 0, 'first_seen': now})
+            entry['attempts'] += 1
+            entry['last_checked'] = now
+            entry['expires'] = now + ttl
+            entry['next_retry'] = now + min(self.RETRY_MAX, retry_base * 2 ** (entry['attempts'] - 1))
+            self._save()
+            self._append_log(title, now)
+
+    def record_found(self, title):
+        """
+        Forget a book once it has been found.
+        :param title: The title as it was requested.
+        """
+        with self._lock:
+            if self._entries.pop(self.key(title), None) is not None:
+                self._save()
+
+    def due(self, limit=None):
+        """
+        Return the titles whose next re-check is due, oldest first.
+        :param limit: The maximum number of titles to return.
+        """
+        now = time.time()
+        with self._lock:
+            entries = sorted((entry for entry in self._entries.values() if entry['next_retry'] <= now),
+                             key=lambda entry: entry['next_retry'])
+        return [entry['title'] for entry in entries[:limit]]
+
+
+class RetryScheduler:
+    """
+    Periodically re-checks books from a NotFoundStore in small batches on a background thread.
+    """
+
+    def __init__(self, store, retry, interval=10 * 60, batch_size=5):
+        """
+        Initializes the RetryScheduler object.
+        :param store: The NotFoundStore to take due titles from.
+        :param retry: A callable that searches for a title again, bypassing the negative cache.
+            It is expected to record the outcome in the store.
+        :param interval: Seconds between batches.
+        :param batch_size: The maximum number of titles re-checked per batch.
+        """
+        self._store = store
+        self._retry = retry
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """
+        Re-check one batch of due titles.
+        :return: The titles that were re-checked.
+        """
+        titles = self._store.due(self.batch_size)
+        for title in titles:
+            if self._stop.is_set():
+                break
+            ic(f"Retrying the search for '{title}' ...")
+            try:
+                self._retry(title)
+            except Exception as e:
+                ic(f"Retrying '{title}' failed: {e}")
+                self._store.record_miss(title)
+        return titles
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='not-found-retry', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,357 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from icecream import ic
+
+from delivery_log import DeliveryLog
+from json_store import load_json, save_json
+from metrics import metrics
+
+
+class Outbox:
+    """
+    A durable queue of emails waiting to be sent.
+
+    Every queued book is linked or copied into a spool directory, so clearing the books folder
+    does not lose it, and the queue is persisted as JSON after every change, so deliveries
+    survive a crash or a restart. Failed sends are retried with exponential backoff per entry,
+    and entries that fail permanently or too often are moved to a dead-letter list.
+    """
+
+    STORE_FILE = 'Logs/outbox.json'
+    SPOOL_DIRECTORY = 'Outbox/'
+    RETRY_BASE = 30
+    RETRY_MAX = 60 * 60
+    MAX_ATTEMPTS = 8
+
+    def __init__(self, path=STORE_FILE, spool_dir=SPOOL_DIRECTORY, max_attempts=MAX_ATTEMPTS):
+        """
+        Initializes the Outbox object.
+        :param path: The JSON file the queue is loaded from and saved to.
+        :param spool_dir: The directory queued books are kept in until they are sent.
+        :param max_attempts: The number of failed sends after which an entry is dead-lettered.
+        """
+        self._path = path
+        self._spool_dir = spool_dir
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._entries, self._dead = self._load()
+        # Entries claimed by a process that died are sent again
+        for entry in self._entries.values():
+            entry['claimed'] = False
+
+    def _load(self):
+        data = load_json(self._path, 'outbox') or {}
+        return data.get('pending', {}), data.get('dead', {})
+
+    def _save(self):
+        save_json(self._path, {'pending': self._entries, 'dead': self._dead})
+
+    def _spool(self, file_path, entry_id):
+        os.makedirs(self._spool_dir, exist_ok=True)
+        spool_path = os.path.join(self._spool_dir, f"{entry_id}-{os.path.basename(file_path)}")
+        try:
+            os.link(file_path, spool_path)
+        except OSError:
+            shutil.copy2(file_path, spool_path)
+        return os.path.abspath(spool_path)
+
+    def enqueue(self, from_email, recipients, subject, html_content, file_path, file_name=None, md5=None):
+        """
+        Queue a book to be emailed to one or more recipients.
+        :param from_email: The email address of the sender.
+        :param recipients: The email addresses of the recipients.
+        :param subject: The subject of the email.
+        :param html_content: The HTML content of the email.
+        :param file_path: The path of the book to attach.
+        :param file_name: The name of the attachment, by default the name of the file.
+        :param md5: The MD5 of the book, if known, to record successful deliveries in a SentLedger.
+        :return: The id of the queued entry.
+        """
+        entry_id = uuid.uuid4().hex[:12]
+        entry = {
+            'id': entry_id,
+            'from_email': from_email,
+            'recipients': list(dict.fromkeys(recipients)),
+            'subject': subject,
+            'html_content': html_content,
+            'file_path': self._spool(file_path, entry_id),
+            'file_name': file_name or os.path.basename(file_path),
+            'md5': md5,
+            'attempts': 0,
+            'created': time.time(),
+            'next_attempt': 0.0,
+            'last_error': None,
+            'claimed': False,
+        }
+        with self._lock:
+            self._entries[entry_id] = entry
+            self._save()
+            self._changed.notify_all()
+        metrics.inc('outbox_enqueued_total')
+        return entry_id
+
+    def claim_due(self, limit=None):
+        """
+        Claim the entries whose next attempt is due, oldest first, so no other sender takes them.
+        :param limit: The maximum number of entries to claim.
+        :return: Copies of the claimed entries.
+        """
+        now = time.time()
+        with self._lock:
+            due = sorted((entry for entry in self._entries.values()
+                          if not entry['claimed'] and entry['next_attempt'] <= now),
+                         key=lambda entry: entry['next_attempt'])[:limit]
+            for entry in due:
+                entry['claimed'] = True
+            return [dict(entry) for entry in due]
+
+    def complete(self, entry_id, statuses):
+        """
+        Record the outcome of sending a claimed entry.
+
+        Recipients the message was accepted for are done. The others are retried after a backoff,
+        unless SendGrid rejected the message outright or the entry ran out of attempts, in which
+        case the entry is dead-lettered.
+
+        :param entry_id: The id of the entry.
+        :param statuses: The status code of every recipient, None where the request failed.
+        :return: 'sent', 'retry' or 'dead'.
+        """
+        with self._lock:
+            entry = self._entries[entry_id]
+            failed = [recipient for recipient in entry['recipients']
+                      if not self.is_accepted(statuses.get(recipient))]
+            entry['claimed'] = False
+            if not failed:
+                del self._entries[entry_id]
+                outcome = 'sent'
+            else:
+                entry['recipients'] = failed
+                entry['attempts'] += 1
+                entry['last_error'] = {recipient: statuses.get(recipient) for recipient in failed}
+                permanent = all(not self.is_retryable(statuses.get(recipient)) for recipient in failed)
+                if permanent or entry['attempts'] >= self.max_attempts:
+                    self._dead[entry_id] = self._entries.pop(entry_id)
+                    outcome = 'dead'
+                else:
+                    entry['next_attempt'] = time.time() + min(
+                        self.RETRY_MAX, self.RETRY_BASE * 2 ** (entry['attempts'] - 1))
+                    outcome = 'retry'
+            self._save()
+            self._changed.notify_all()
+        if outcome == 'sent':
+            self._unspool(entry['file_path'])
+        metrics.inc('outbox_sends_total', outcome=outcome)
+        return outcome
+
+    def _unspool(self, spool_path):
+        try:
+            os.remove(spool_path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def is_accepted(status_code):
+        """
+        Return True for the status codes of a message SendGrid accepted.
+        """
+        return status_code is not None and 200 <= status_code < 300
+
+    @staticmethod
+    def is_retryable(status_code):
+        """
+        Return True if a failed send may succeed later: the request failed, was throttled or hit
+        a server error.
+        """
+        return status_code is None or status_code == 429 or status_code >= 500
+
+    def requeue_dead(self, entry_id=None):
+        """
+        Move dead-lettered entries back into the queue with a fresh attempt count.
+        :param entry_id: The id of the entry to requeue, or None for all of them.
+        :return: The number of requeued entries.
+        """
+        with self._lock:
+            ids = list(self._dead) if entry_id is None else [entry_id]
+            for dead_id in ids:
+                entry = self._dead.pop(dead_id)
+                entry.update(attempts=0, next_attempt=0.0, claimed=False)
+                self._entries[dead_id] = entry
+            if ids:
+                self._save()
+                self._changed.notify_all()
+            return len(ids)
+
+    def dead_letters(self):
+        """
+        Return copies of the dead-lettered entries.
+        """
+        with self._lock:
+            return [dict(entry) for entry in self._dead.values()]
+
+    def queued_recipients(self, md5):
+        """
+        Return the recipients a book with the given MD5 is already queued for.
+        """
+        with self._lock:
+            return {recipient for entry in self._entries.values() if entry.get('md5') == md5
+                    for recipient in entry['recipients']}
+
+    def pending(self):
+        """
+        Return the number of entries waiting to be sent, including those backing off.
+        """
+        with self._lock:
+            return len(self._entries)
+
+    def wait_until_settled(self, timeout=None):
+        """
+        Wait until no entry is due or being sent. Entries backing off after a failure are left
+        for later.
+        :param timeout: The maximum number of seconds to wait.
+        :return: True if the outbox settled, False on timeout.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while True:
+                now = time.time()
+                busy = [entry for entry in self._entries.values()
+                        if entry['claimed'] or entry['next_attempt'] <= now]
+                if not busy:
+                    return True
+                wait = 1.0 if end is None else min(1.0, end - time.monotonic())
+                if wait <= 0:
+                    return False
+                self._changed.wait(wait)
+
+    def wake(self):
+        """
+        Wake every thread waiting on the outbox.
+        """
+        with self._lock:
+            self._changed.notify_all()
+
+    def wait_for_work(self, timeout):
+        """
+        Block until an entry may be due, or for at most timeout seconds.
+        """
+        with self._lock:
+            now = time.time()
+            next_attempts = [entry['next_attempt'] for entry in self._entries.values() if not entry['claimed']]
+            if next_attempts and min(next_attempts) <= now:
+                return
+            if next_attempts:
+                timeout = min(timeout, min(next_attempts) - now)
+            self._changed.wait(timeout)
+
+
+class OutboxSender:
+    """
+    Drains an Outbox on background threads, sending several emails at once.
+    """
+
+    def __init__(self, outbox, mail_service, delivery_log=None, ledger=None, workers=4, poll_interval=5.0):
+        """
+        Initializes the OutboxSender object.
+        :param outbox: The Outbox to take entries from.
+        :param mail_service: The MailService used to send them.
+        :param delivery_log: The DeliveryLog the outcome of every attempt is recorded in, if any.
+        :param ledger: The SentLedger successful deliveries are recorded in, if any.
+        :param workers: The number of emails sent concurrently.
+        :param poll_interval: The longest time in seconds between two looks at the outbox.
+        """
+        self._outbox = outbox
+        self._mail_service = mail_service
+        self._delivery_log = delivery_log
+        self._ledger = ledger
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._slots = threading.Semaphore(workers)
+        self._stop = threading.Event()
+        self._executor = None
+        self._thread = None
+
+    def _send(self, entry):
+        try:
+            try:
+                statuses = self._mail_service.send_email_to_recipients(
+                    from_email=entry['from_email'],
+                    recipients=entry['recipients'],
+                    subject=entry['subject'],
+                    html_content=entry['html_content'],
+                    file_path=entry['file_path'],
+                    file_name=entry['file_name'],
+                )
+            except Exception as e:
+                ic(f"Sending '{entry['file_name']}' failed: {e}")
+                statuses = {}
+            # The ledger is written before the entry leaves the outbox, so a book is never seen
+            # as neither queued nor sent and queued again
+            self._record_sent(entry, statuses)
+            outcome = self._outbox.complete(entry['id'], statuses)
+            self._record(entry, statuses, outcome)
+        finally:
+            self._slots.release()
+
+    def _record_sent(self, entry, statuses):
+        if self._ledger is None or not entry.get('md5'):
+            return
+        for recipient in entry['recipients']:
+            if Outbox.is_accepted(statuses.get(recipient)):
+                self._ledger.record(entry['md5'], recipient, entry['file_name'])
+
+    def _record(self, entry, statuses, outcome):
+        if self._delivery_log is None:
+            return
+        for recipient in entry['recipients']:
+            status_code = statuses.get(recipient)
+            if Outbox.is_accepted(status_code):
+                status = DeliveryLog.SENT
+            elif outcome == 'retry' and Outbox.is_retryable(status_code):
+                status = DeliveryLog.RETRYING
+            else:
+                status = DeliveryLog.FAILED
+            self._delivery_log.record(book=entry['file_name'], recipient=recipient, channel='email',
+                                      status=status, detail=status_code)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._outbox.wait_for_work(self.poll_interval)
+            while not self._stop.is_set() and self._slots.acquire(timeout=self.poll_interval):
+                claimed = self._outbox.claim_due(limit=1)
+                if not claimed:
+                    self._slots.release()
+                    break
+                self._executor.submit(self._send, claimed[0])
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='outbox-send')
+            self._thread = threading.Thread(target=self._run, name='outbox-sender', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, drain=True, timeout=None):
+        """
+        Stop the sender.
+        :param drain: Wait for the entries that are due to be sent first. Entries backing off stay
+            in the outbox and are sent by the next sender.
+        :param timeout: The maximum number of seconds to wait for the outbox to drain.
+        """
+        if self._thread is None:
+            return
+        if drain:
+            self._outbox.wait_until_settled(timeout)
+        self._stop.set()
+        self._outbox.wake()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        self._thread = None
+        self._executor = None
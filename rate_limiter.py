@@ -0,0 +1,262 @@
+import hashlib
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from icecream import ic
+
+import deadline
+
+
+THROTTLED_STATUSES = (429, 503)
+
+
+def api_key_bucket(service, api_key):
+    """
+    Return the bucket name for an API key without exposing the key itself.
+    :param service: The name of the service the key belongs to.
+    :param api_key: The API key.
+    """
+    return f"{service}:{hashlib.sha1((api_key or '').encode()).hexdigest()[:8]}"
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header given either in seconds or as an HTTP date.
+    :return: The number of seconds to wait, or None if the header is missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket whose rate backs off when the server throttles us and creeps
+    back up to its ceiling as requests succeed.
+    """
+
+    RECOVERY_STEP = 0.05
+
+    def __init__(self, rate, capacity):
+        """
+        Initializes the TokenBucket object.
+        :param rate: The maximum number of requests per second.
+        :param capacity: The number of requests that may be made in a burst.
+        """
+        self.ceiling = rate
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """
+        Take a token and return how many seconds the caller must wait before using it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def throttled(self, delay):
+        """
+        Halve the rate and hold every request for the given number of seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.ceiling / 32, self.rate / 2)
+            self._blocked_until = max(self._blocked_until, now + delay)
+
+    def succeeded(self):
+        """
+        Move the rate back towards its ceiling after a successful request.
+        """
+        with self._lock:
+            if self.rate < self.ceiling:
+                self._refill(time.monotonic())
+                self.rate = min(self.ceiling, self.rate + self.ceiling * self.RECOVERY_STEP)
+
+    def state(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                'rate': self.rate,
+                'ceiling': self.ceiling,
+                'capacity': self.capacity,
+                'tokens': self._tokens,
+                'blocked_for': max(0.0, self._blocked_until - now),
+            }
+
+
+class RateLimiter:
+    """
+    Central throttle for every outbound call, with a token bucket per host and per API key.
+
+    Requests that come back with 429 or 503 are retried after the server's Retry-After, or after
+    a jittered exponential backoff when it does not send one, and the bucket's rate is halved so
+    that other callers slow down too.
+    """
+
+    DEFAULT_LIMITS = {
+        'libgen.is': (0.5, 2),
+        'singlelogin.se': (2.0, 5),
+        'isbn': (1.0, 2),
+        'api.openai.com': (3.0, 10),
+        'api.sendgrid.com': (2.0, 5),
+    }
+    DEFAULT_LIMIT = (1.0, 3)
+
+    def __init__(self, limits=None, default=DEFAULT_LIMIT, max_retries=5, base_backoff=1.0, max_backoff=60.0):
+        """
+        Initializes the RateLimiter object.
+        :param limits: A mapping of bucket names to (requests per second, burst) pairs.
+        :param default: The limit of buckets that are not listed.
+        :param max_retries: How often a throttled call is retried before giving up.
+        :param base_backoff: The backoff in seconds after the first throttled attempt.
+        :param max_backoff: The largest backoff in seconds.
+        """
+        self._limits = dict(self.DEFAULT_LIMITS if limits is None else limits)
+        self._default = default
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        """
+        Return the bucket for a host or API key, creating it on first use.
+        """
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(*self._limits.get(key, self._default))
+            return self._buckets[key]
+
+    def set_limit(self, key, rate, capacity):
+        """
+        Change the limit of a bucket.
+        :param key: The host or API key bucket name.
+        :param rate: The maximum number of requests per second.
+        :param capacity: The number of requests that may be made in a burst.
+        """
+        with self._lock:
+            self._limits[key] = (rate, capacity)
+            self._buckets[key] = TokenBucket(rate, capacity)
+
+    def limits(self):
+        """
+        Return the current state of every bucket.
+        """
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {key: bucket.state() for key, bucket in buckets.items()}
+
+    def acquire(self, *keys):
+        """
+        Block until every given bucket allows another request, or until the current deadline
+        runs out, in which case DeadlineExceeded is raised.
+        """
+        wait = max((self.bucket(key).reserve() for key in keys if key), default=0.0)
+        if wait > 0:
+            time.sleep(deadline.timeout(wait))
+            deadline.check()
+
+    def _backoff(self, attempt, retry_after):
+        if retry_after is not None:
+            return min(self.max_backoff, retry_after)
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def _throttled(self, keys, attempt, retry_after):
+        delay = self._backoff(attempt, retry_after)
+        ic(f"Throttled by {keys[0]}, backing off for {delay:.1f}s")
+        for key in keys:
+            if key:
+                self.bucket(key).throttled(delay)
+
+    def _succeeded(self, keys):
+        for key in keys:
+            if key:
+                self.bucket(key).succeeded()
+
+    def request(self, method, url, key=None, session=None, **kwargs):
+        """
+        Make an HTTP request through the limiter.
+        :param method: The HTTP method.
+        :param url: The URL to request.
+        :param key: An additional bucket, such as an API key, the request counts against.
+        :param session: The requests session to use, if any.
+        :param kwargs: Passed on to requests. The timeout is capped by the current deadline.
+        :return: The response. Throttled responses are only returned once the retries run out.
+        """
+        keys = (urlparse(url).netloc.lower(), key)
+        sender = session if session is not None else requests
+        default_timeout = kwargs.pop('timeout', None)
+        for attempt in range(self.max_retries + 1):
+            self.acquire(*keys)
+            kwargs['timeout'] = deadline.timeout(default_timeout)
+            response = sender.request(method, url, **kwargs)
+            if response.status_code not in THROTTLED_STATUSES:
+                self._succeeded(keys)
+                return response
+            if attempt == self.max_retries:
+                return response
+            self._throttled(keys, attempt, parse_retry_after(response.headers.get('Retry-After')))
+            response.close()
+
+    @staticmethod
+    def _status_of(error):
+        status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+        return status if isinstance(status, int) else None
+
+    @staticmethod
+    def _retry_after_of(error):
+        headers = getattr(error, 'headers', None)
+        if headers is None:
+            headers = getattr(getattr(error, 'response', None), 'headers', None)
+        return parse_retry_after(headers.get('Retry-After')) if headers is not None else None
+
+    def call(self, host, function, *args, key=None, **kwargs):
+        """
+        Call a client library function through the limiter, retrying when it raises a 429 or 503.
+        :param host: The bucket of the host the function talks to.
+        :param function: The function to call.
+        :param key: An additional bucket, such as an API key, the call counts against.
+        :return: The return value of the function.
+        """
+        keys = (host, key)
+        for attempt in range(self.max_retries + 1):
+            self.acquire(*keys)
+            deadline.check()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                if self._status_of(e) not in THROTTLED_STATUSES or attempt == self.max_retries:
+                    raise
+                self._throttled(keys, attempt, self._retry_after_of(e))
+            else:
+                self._succeeded(keys)
+                return result
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,68 @@
+MIRROR_COLUMNS = ('Mirror_1', 'Mirror_2', 'Mirror_3')
+
+
+def _url(value):
+    # Empty CSV cells come back from pandas as NaN
+    return value if isinstance(value, str) and value else None
+
+
+class MirrorLinks:
+    """
+    The mirror page URLs one copy of a book can be downloaded from, in the order of the
+    Mirror_1, Mirror_2 and Mirror_3 columns. Missing mirrors are None.
+    """
+
+    __slots__ = ('urls',)
+
+    def __init__(self, urls):
+        self.urls = tuple(_url(url) for url in urls)
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Build the links from a Libgen search result or a CSV row with Mirror_1..3 keys.
+        """
+        return cls(row.get(column) for column in MIRROR_COLUMNS)
+
+    def by_column(self):
+        """
+        Return the available mirror URLs by column name.
+        """
+        return {column: url for column, url in zip(MIRROR_COLUMNS, self.urls) if url}
+
+    def __bool__(self):
+        return any(self.urls)
+
+    def __eq__(self, other):
+        return isinstance(other, MirrorLinks) and self.urls == other.urls
+
+    def __hash__(self):
+        return hash(self.urls)
+
+    def __repr__(self):
+        return f"MirrorLinks({list(self.urls)!r})"
+
+
+class Candidate:
+    """
+    One Libgen search result: a copy of a book in one format, with the mirrors serving it.
+    """
+
+    __slots__ = ('title', 'extension', 'size', 'links')
+
+    def __init__(self, title, extension, size, links):
+        self.title = title
+        self.extension = extension
+        self.size = size
+        self.links = links
+
+    @classmethod
+    def from_result(cls, result):
+        """
+        Build a candidate from a libgen_api search result.
+        """
+        return cls(result.get('Title'), str(result.get('Extension', '')).lower(), result.get('Size'),
+                   MirrorLinks.from_row(result))
+
+    def __repr__(self):
+        return f"Candidate({self.title!r}, {self.extension!r}, {self.size!r}, {self.links!r})"
@@ -0,0 +1,84 @@
+import re
+import unicodedata
+
+from isbnlib import canonical, get_isbnlike, is_isbn10, is_isbn13, to_isbn13
+
+
+LEADING_ARTICLES = ('the', 'a', 'an')
+SUBTITLE_SEPARATOR = re.compile(r'\s*[:;]\s*|\s+[-–—]\s+|\s*[(\[]')
+
+
+def find_isbn(text):
+    """
+    Return the first valid ISBN in a text as an ISBN-13, or None if there is none.
+    """
+    for candidate in get_isbnlike(str(text)):
+        isbn = canonical(candidate)
+        if is_isbn13(isbn):
+            return isbn
+        if is_isbn10(isbn):
+            return to_isbn13(isbn)
+    return None
+
+
+def normalize_title(title):
+    """
+    Reduce a title to a form that is the same for trivially different spellings of a book:
+    accents, case, punctuation and a leading article are dropped.
+    """
+    title = unicodedata.normalize('NFKD', str(title)).encode('ascii', 'ignore').decode()
+    title = title.lower().replace('&', ' and ')
+    words = re.sub(r'[^\w\s]', ' ', title).split()
+    if len(words) > 1 and words[0] in LEADING_ARTICLES:
+        words = words[1:]
+    return ' '.join(words)
+
+
+def main_title(title):
+    """
+    Return the normalized title without its subtitle.
+    """
+    main = SUBTITLE_SEPARATOR.split(str(title), maxsplit=1)[0]
+    return normalize_title(main if main.strip() else title)
+
+
+def request_key(title):
+    """
+    Return the key identifying the book a request asks for: its ISBN-13 if the request contains
+    one, otherwise its normalized title.
+    """
+    isbn = find_isbn(title)
+    return f"isbn:{isbn}" if isbn else normalize_title(title)
+
+
+def group_requests(requests, title_of=lambda request: request):
+    """
+    Group duplicate requests for the same book before a batch starts.
+
+    Requests are duplicates if they contain the same ISBN, if their normalized titles are equal,
+    or if one of them is the other without its subtitle. Two requests with different subtitles,
+    such as two volumes of a series, are kept apart, and a title without a subtitle is only
+    merged with a subtitled one if that is the only subtitled variant of it in the batch, in
+    whatever order they come.
+
+    :param requests: The requests, in the order they were made.
+    :param title_of: A function returning the title of a request.
+    :return: A dictionary mapping every request key to its requests, in order of first appearance.
+    """
+    keyed = []
+    subtitled = {}
+    for request in requests:
+        title = title_of(request)
+        key = request_key(title)
+        main = None if key.startswith('isbn:') else main_title(title)
+        if main is not None and main != key:
+            subtitled.setdefault(main, set()).add(key)
+        keyed.append((request, key, main))
+
+    groups = {}
+    merged_keys = {}
+    for request, key, main in keyed:
+        if main is not None and len(subtitled.get(main, ())) == 1:
+            key = merged_keys.setdefault(main, key)
+        groups.setdefault(key, []).append(request)
+    return groups
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import threading
+import time
+
+from json_store import load_json, save_json
+
+
+class SentLedger:
+    """
+    Remembers which book files have been delivered to which recipients.
+
+    A delivery is recorded by the MD5 of the file, so a book is sent again if its content changes
+    but not if it is only renamed or left in the books folder. The hashes are cached by path, size
+    and modification time, so a large library is not re-read on every run. The ledger is persisted
+    as JSON.
+    """
+
+    LEDGER_FILE = 'Logs/sent_ledger.json'
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, path=LEDGER_FILE):
+        """
+        Initializes the SentLedger object.
+        :param path: The JSON file the ledger is loaded from and saved to.
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._sent, self._hashes = self._load()
+
+    def _load(self):
+        data = load_json(self._path, 'sent ledger') or {}
+        # Hashes of files that were removed from the disk are dropped
+        hashes = {path: entry for path, entry in data.get('hashes', {}).items() if os.path.exists(path)}
+        return data.get('sent', {}), hashes
+
+    def _save(self):
+        save_json(self._path, {'sent': self._sent, 'hashes': self._hashes})
+
+    def file_hash(self, file_path):
+        """
+        Return the MD5 of a file, reading it only if it changed since it was last hashed.
+        """
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._hashes.get(path)
+            if cached is not None and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+                return cached['md5']
+
+        digest = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                digest.update(chunk)
+        md5 = digest.hexdigest()
+        with self._lock:
+            self._hashes[path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'md5': md5}
+            self._save()
+        return md5
+
+    def unsent_recipients(self, md5, recipients):
+        """
+        Return the recipients a file has not been delivered to yet, in order.
+        :param md5: The MD5 of the file.
+        :param recipients: The recipients to check.
+        """
+        with self._lock:
+            return [recipient for recipient in recipients if md5 not in self._sent.get(recipient, {})]
+
+    def record(self, md5, recipient, file_name=None):
+        """
+        Record that a file was delivered to a recipient.
+        :param md5: The MD5 of the file.
+        :param recipient: The address the file was delivered to.
+        :param file_name: The name the file was sent under, kept for reference.
+        """
+        with self._lock:
+            self._sent.setdefault(recipient, {})[md5] = {'file': file_name, 'timestamp': time.time()}
+            self._save()
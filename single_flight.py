@@ -0,0 +1,60 @@
+import threading
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Makes concurrent calls for the same key share a single execution.
+
+    The first caller for a key runs the function. Callers that arrive while it is still running
+    wait for it and receive the same result, or the same exception. Once the call has finished
+    the key is forgotten, so a later call runs the function again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn for a key, or wait for the call already in flight for that key.
+        :param key: The key identifying the work.
+        :param fn: The function to call.
+        :return: A tuple of the result and whether it was shared with a call already in flight.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        """
+        Return the number of calls currently in flight.
+        """
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,138 @@
+import re
+
+from icecream import ic
+
+from metrics import metrics
+
+
+class SourcePlanner:
+    """
+    Chooses which copy of a book to download by its expected total cost.
+
+    The same book is often available in several formats, from Libgen and from Z-Library. The
+    cost of a copy is the expected download time, estimated from its size and the observed speed
+    of its hosts, plus the time calibre needs to convert it to EPUB. Native EPUBs need no
+    conversion, so they win whenever one is available at a reasonable download cost.
+    """
+
+    NATIVE_FORMAT = 'epub'
+    FORMATS = ('epub', 'mobi', 'azw3')
+    CONVERSION_OVERHEAD = 30.0
+    CONVERSION_THROUGHPUT = 256 * 1024
+    SIZE_UNITS = {'b': 1, 'bytes': 1, 'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3}
+
+    def __init__(self, mirror_health):
+        """
+        Initializes the SourcePlanner object.
+        :param mirror_health: The MirrorHealthTracker the download speed of every host is taken from.
+        """
+        self._mirror_health = mirror_health
+
+    @classmethod
+    def parse_size(cls, size):
+        """
+        Return a size in bytes from a number or a Libgen size such as '2 Mb', or None if unknown.
+        """
+        if isinstance(size, (int, float)):
+            return int(size) if size > 0 else None
+        match = re.match(r'\s*([\d.]+)\s*([a-zA-Z]*)', str(size or ''))
+        if not match:
+            return None
+        unit = cls.SIZE_UNITS.get(match.group(2).lower() or 'b')
+        return int(float(match.group(1)) * unit) if unit else None
+
+    def conversion_time(self, extension, size=None):
+        """
+        Estimate how long converting a book of the given format and size to EPUB takes.
+        """
+        if extension == self.NATIVE_FORMAT:
+            return 0.0
+        size = size or self._mirror_health.EXPECTED_BOOK_SIZE
+        return self.CONVERSION_OVERHEAD + size / self.CONVERSION_THROUGHPUT
+
+    def download_time(self, hosts, size=None):
+        """
+        Estimate how long downloading a book of the given size from the fastest of its available
+        hosts takes, or None if every host has an open circuit.
+        """
+        size = size or self._mirror_health.EXPECTED_BOOK_SIZE
+        times = [self._mirror_health.expected_time(host, size) for host in hosts if self._mirror_health.is_available(host)]
+        return min(times) if times else None
+
+    def cost(self, extension, size, hosts):
+        """
+        Return the expected total cost in seconds of a copy, or None if it cannot be downloaded.
+        :param extension: The format of the copy.
+        :param size: The size of the copy in bytes, or None if unknown.
+        :param hosts: The hosts the copy can be downloaded from.
+        """
+        if extension not in self.FORMATS:
+            return None
+        download_time = self.download_time(hosts, size)
+        if download_time is None:
+            return None
+        return download_time + self.conversion_time(extension, size)
+
+    def libgen_cost(self, candidate):
+        """
+        Return the expected total cost of a Libgen search result.
+        :param candidate: The search result, a Candidate.
+        """
+        hosts = [self._mirror_health.host_of(url) for url in candidate.links.urls if url]
+        return self.cost(candidate.extension, self.parse_size(candidate.size), hosts)
+
+    def rank_libgen(self, candidates):
+        """
+        Order Libgen search results by expected total cost, leaving out those that cannot be
+        converted. Copies whose mirrors all have an open circuit are kept after the others, in
+        their original order, so a book is still known to be on Libgen while its mirrors are down.
+        :param candidates: The search results for the same book, as Candidates.
+        :return: A list of the search results, cheapest first.
+        """
+        costs = [(self.libgen_cost(candidate), candidate) for candidate in candidates]
+        ranked = sorted((item for item in costs if item[0] is not None), key=lambda item: item[0])
+        unavailable = [candidate for cost, candidate in costs if cost is None and candidate.extension in self.FORMATS]
+        return [candidate for _, candidate in ranked] + unavailable
+
+    def zlibrary_cost(self, book, host):
+        """
+        Return the expected total cost of a Z-Library search result.
+        :param book: The search result, with its extension and filesize.
+        :param host: The Z-Library download host.
+        """
+        return self.cost(str(book.get('extension', '')).lower(), self.parse_size(book.get('filesize')), [host])
+
+    def zlibrary_formats(self, zlibrary, book):
+        """
+        Gather every format Z-Library offers of a book: the search result itself and the other
+        formats returned by Zlibrary.getBookFormat.
+        :param zlibrary: The Zlibrary session.
+        :param book: The search result.
+        :return: A list of Z-Library books, one per format.
+        """
+        books = [book]
+        try:
+            with metrics.timer('zlibrary_formats', source='zlibrary'):
+                response = zlibrary.getBookFormat(book['id'], book['hash'])
+        except Exception as e:
+            ic(f"Could not get the formats of '{book.get('title')}': {e}")
+            return books
+        for other in (response or {}).get('books') or []:
+            if other.get('id') and other.get('hash') and other.get('extension') != book.get('extension'):
+                books.append(other)
+        return books
+
+    def choose_zlibrary(self, zlibrary, book, host):
+        """
+        Choose the cheapest format of a Z-Library book.
+        :param zlibrary: The Zlibrary session.
+        :param book: The search result.
+        :param host: The Z-Library download host.
+        :return: The cheapest Z-Library book, or None if no format can be converted to EPUB.
+        """
+        if str(book.get('extension', '')).lower() == self.NATIVE_FORMAT:
+            return book
+        costs = [(self.zlibrary_cost(other, host), index, other)
+                 for index, other in enumerate(self.zlibrary_formats(zlibrary, book))]
+        costs = [item for item in costs if item[0] is not None]
+        return min(costs)[2] if costs else None
@@ -0,0 +1,127 @@
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+from icecream import ic
+
+from file_handler import move_file
+
+
+PARTIAL_SUFFIXES = ('.crdownload', '.part', '.tmp')
+
+
+def is_partial(file_name):
+    """
+    Return True for hidden files and files that are still being downloaded.
+    """
+    return file_name.startswith('.') or file_name.endswith(PARTIAL_SUFFIXES)
+
+
+class StagingArea:
+    """
+    Gives every download job its own staging directory under the downloads folder.
+
+    A job only ever looks at its own directory, so several downloads can run at once in one
+    process or across processes without picking up each other's files. Finished files are moved
+    into their destination with an atomic rename. Directories left behind by jobs whose process
+    died are garbage-collected.
+    """
+
+    ROOT = 'Downloads/'
+    OWNER_FILE = '.owner'
+    ORPHAN_AGE = 6 * 60 * 60
+
+    def __init__(self, root=ROOT):
+        """
+        Initializes the StagingArea object.
+        :param root: The directory the job directories are created in.
+        """
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def create(self):
+        """
+        Create a new job directory owned by this process.
+        :return: The absolute path of the directory.
+        """
+        job_dir = os.path.abspath(os.path.join(self.root, f"job-{os.getpid()}-{uuid.uuid4().hex[:12]}"))
+        os.makedirs(job_dir)
+        with open(os.path.join(job_dir, self.OWNER_FILE), 'w') as f:
+            f.write(str(os.getpid()))
+        return job_dir
+
+    def release(self, job_dir):
+        """
+        Remove a job directory and anything left in it.
+        """
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+    @contextmanager
+    def job(self):
+        """
+        Provide a fresh job directory for the duration of a block and remove it afterwards.
+        """
+        job_dir = self.create()
+        try:
+            yield job_dir
+        finally:
+            self.release(job_dir)
+
+    @staticmethod
+    def finished_files(job_dir):
+        """
+        Return the completely downloaded files in a job directory.
+        """
+        return sorted(name for name in os.listdir(job_dir)
+                      if not is_partial(name) and os.path.isfile(os.path.join(job_dir, name)))
+
+    def commit(self, file_path, destination_dir):
+        """
+        Atomically move a finished file from a job directory into its destination.
+        :param file_path: The file to move.
+        :param destination_dir: The directory to move it to.
+        :return: The new path of the file.
+        """
+        return move_file(file_path, destination_dir)
+
+    @staticmethod
+    def _owner_alive(job_dir):
+        try:
+            with open(os.path.join(job_dir, StagingArea.OWNER_FILE)) as f:
+                pid = int(f.read().strip())
+        except (OSError, ValueError):
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def collect_garbage(self, max_age=ORPHAN_AGE):
+        """
+        Remove job directories whose owning process is gone or that are older than max_age, and
+        stale partial downloads left directly in the root.
+        :param max_age: Seconds after which anything in the staging area is considered orphaned.
+        :return: The number of entries removed.
+        """
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.root):
+            try:
+                age = now - entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if entry.is_dir() and entry.name.startswith('job-'):
+                if age > max_age or not self._owner_alive(entry.path):
+                    self.release(entry.path)
+                    removed += 1
+            elif entry.is_file() and is_partial(entry.name) and age > max_age:
+                os.remove(entry.path)
+                removed += 1
+        if removed:
+            ic(f"Removed {removed} orphaned download(s) from {self.root}")
+        return removed
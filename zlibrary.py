@@ -1,10 +1,15 @@
 import requests
-from typing import Union, Dict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Union, Dict, Iterator
 from icecream import ic
+from rate_limiter import rate_limiter
+from metrics import metrics
+from cover_cache import CoverCache
+import deadline
 
 class Zlibrary:
 
-    def __init__(self, email: str = None, password: str = None, remix_userid: Union[int, str] = None, remix_userkey: str = None):
+    def __init__(self, email: str = None, password: str = None, remix_userid: Union[int, str] = None, remix_userkey: str = None, base_url: str = None, cover_cache: CoverCache = None):
         
         self.__email: str
         self.__name: str
@@ -12,7 +17,13 @@ class Zlibrary:
         self.__remix_userid: Union[int, str]
         self.__remix_userkey: str
         self.__domain = "singlelogin.se"
+        self.__baseUrl = base_url.rstrip("/") if base_url is not None else "https://" + self.__domain
         self.__imgDownloadDomains = ["z-library.se", "zlibrary-in.se", "zlibrary-africa.se"]
+        self.__imgTimeout = 10
+        self.__timeout = 30
+        self.__downloadTimeout = 120
+        self.__downloadChunkSize = 64 * 1024
+        self.__coverCache = cover_cache if cover_cache is not None else CoverCache()
         self.__logged = False
 
         self.__headers = {
@@ -157,11 +168,13 @@ class Zlibrary:
         if not self.__logged and override is False:
             ic("Not logged in")
             return
-        response = requests.post(
-            "https://" + self.__domain + url,
+        response = rate_limiter.request(
+            'POST',
+            self.__baseUrl + url,
             data=data,
             cookies=self.__cookies,
             headers=self.__headers,
+            timeout=self.__timeout,
         ).json()
         if not response["success"]:
             ic(response["error"])
@@ -188,11 +201,13 @@ class Zlibrary:
         if not self.__logged and cookies is None:
             ic("Not logged in")
             return
-        response = requests.get(
-            "https://" + self.__domain + url,
+        response = rate_limiter.request(
+            'GET',
+            self.__baseUrl + url,
             params=params,
             cookies=self.__cookies if cookies is None else cookies,
             headers=self.__headers,
+            timeout=self.__timeout,
         ).json()
         return response
 
@@ -439,6 +454,17 @@ class Zlibrary:
     def saveBook(self, bookid: Union[int, str]) -> Dict[str, str]:
         return self.__makeGetRequest(f'/eapi/user/book/{bookid}/save')
 
+    def getKindleEmail(self) -> str:
+        """
+        Gets the Kindle address configured on the logged-in account.
+
+        Returns
+        -------
+        str
+            The Kindle address, or None if not logged in.
+        """
+        return self.__kindle_email if self.__logged else None
+
     def sendTo(self, bookid: Union[int, str], hashid: str, totype: str) -> Dict[str, str]:
         return self.__makeGetRequest(f'/eapi/book/{bookid}/{hashid}/send-to-{totype}')
 
@@ -459,21 +485,98 @@ class Zlibrary:
                                                          "name": name, "kindle_email": kindle_email}.items() if v is not None})
 
     def search(self, message: str = None, yearFrom: int = None, yearTo: int = None, languages: str = None, extensions: str = None, order: str = None, page: int = None, limit: int = None) -> Dict[str, str]:
-        return self.__makePostRequest('/eapi/book/search',
-                                      {k: v for k, v in {"message": message, "yearFrom": yearFrom,
-                                                         "yearTo": yearTo, "languages": languages,
-                                                         "extensions": extensions, "order": order,
-                                                         "page": page, "limit": limit,
-                                                         }.items() if v is not None})
+        with metrics.timer('zlibrary_search', source='zlibrary'):
+            return self.__makePostRequest('/eapi/book/search',
+                                          {k: v for k, v in {"message": message, "yearFrom": yearFrom,
+                                                             "yearTo": yearTo, "languages": languages,
+                                                             "extensions": extensions, "order": order,
+                                                             "page": page, "limit": limit,
+                                                             }.items() if v is not None})
+
+    def iterSearch(self, message: str = None, yearFrom: int = None, yearTo: int = None, languages: str = None, extensions: str = None, order: str = None, limit: int = None, maxPages: int = 5) -> Iterator[Dict[str, str]]:
+        """
+        Lazily yields search results across pages.
+
+        The next page is requested in the background while the current one is being consumed,
+        and no further pages are requested once the caller stops iterating.
+
+        Parameters
+        ----------
+        message : str, optional
+            The search query.
+        yearFrom, yearTo : int, optional
+            The range of publication years.
+        languages : str, optional
+            The languages to search in.
+        extensions : str, optional
+            The file extensions to search for.
+        order : str, optional
+            The order to sort the results.
+        limit : int, optional
+            The number of results per page.
+        maxPages : int, optional
+            The maximum number of pages to request.
+
+        Yields
+        ------
+        Dict[str, str]
+            One book from the search results.
+        """
+        def fetch(page):
+            return self.search(message=message, yearFrom=yearFrom, yearTo=yearTo, languages=languages,
+                               extensions=extensions, order=order, page=page, limit=limit)
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            page = 1
+            fetch = deadline.bind(fetch)
+            future = executor.submit(fetch, page)
+            while future is not None:
+                response = future.result()
+                if not response or not response.get("success"):
+                    return
+                books = response.get("books") or []
+                total_pages = (response.get("pagination") or {}).get("total_pages")
+                hasNext = bool(books) and page < maxPages and (
+                    page < total_pages if total_pages else limit is None or len(books) >= limit)
+                page += 1
+                future = executor.submit(fetch, page) if hasNext else None
+                yield from books
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __fetchImage(self, url: str) -> requests.Response.content:
+        res = rate_limiter.request('GET', url, headers=self.__headers,
+                                   cookies=self.__cookies, timeout=self.__imgTimeout)
+        if res.status_code == 200:
+            return res.content
+        return None
 
     def __getImageData(self, url: str) -> requests.Response.content:
         path = url.split("books")[-1]
-        for domain in self.__imgDownloadDomains:
-            url = "https://" + domain + "/covers/books" + path
-            res = requests.get(url, headers=self.__headers,
-                               cookies=self.__cookies)
-            if res.status_code == 200:
-                return res.content
+        cached = self.__coverCache.get(path)
+        if cached is not None:
+            metrics.inc('cover_cache_total', outcome='hit')
+            return cached
+        metrics.inc('cover_cache_total', outcome='miss')
+
+        # Ask every image domain at once and keep the first 200.
+        urls = ["https://" + domain + "/covers/books" + path for domain in self.__imgDownloadDomains]
+        executor = ThreadPoolExecutor(max_workers=len(urls))
+        try:
+            with metrics.timer('zlibrary_cover', source='zlibrary'):
+                futures = [executor.submit(self.__fetchImage, url) for url in urls]
+                for future in as_completed(futures):
+                    try:
+                        content = future.result()
+                    except requests.RequestException as e:
+                        ic(e)
+                        continue
+                    if content is not None:
+                        self.__coverCache.put(path, content)
+                        return content
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def getImage(self, book: Dict[str, str]) -> requests.Response.content:
         return self.__getImageData(book["cover"])
@@ -500,11 +603,19 @@ class Zlibrary:
         headers['authority'] = ddl.split("/")[2]
         
 
-        res = requests.get(ddl, headers=headers)
-        
-        if res.status_code == 200:
-                
-                return filename, res.content
+        # The timeout only bounds each read, so the download is streamed and stopped as soon as
+        # the job runs out of time
+        with metrics.timer('zlibrary_download', source='zlibrary'):
+            with rate_limiter.request('GET', ddl, headers=headers, stream=True, timeout=self.__downloadTimeout) as res:
+                if res.status_code != 200:
+                    return None
+                chunks = []
+                for chunk in res.iter_content(self.__downloadChunkSize):
+                    deadline.check()
+                    chunks.append(chunk)
+        content = b"".join(chunks)
+        metrics.inc('bytes_downloaded_total', len(content), source='zlibrary')
+        return filename, content
 
     def downloadBook(self, book: Dict[str, str]):
         return self.__getBookFile(book["id"], book["hash"])